@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+"""
+OFT to EML Batch Converter
+
+Converts many Outlook Template (.oft) files in one run. Every input is
+pre-scanned first, so corrupt or non-OLE files are rejected (or moved to a
+quarantine directory) before any full parse, and the remaining files are
+scheduled largest-first using the pre-scan size estimates.
+
+A JSON lines report can be streamed while the batch runs: one ``file``
+record per input, then one ``summary`` record at the end.
+
+With deduplication enabled, byte-identical inputs are converted once and the
+other copies become hard links, reflinks or manifest entries pointing at the
+first copy's EML file.
+
+Usage:
+    python oft_to_eml_batch.py -o <output_dir> [--report <file>] <input_file_or_dir>...
+"""
+
+import sys
+import os
+import argparse
+import errno
+import hashlib
+import json
+import shutil
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows; reflinks fall back to copies
+
+from oft_to_eml_converter import (
+    convert_oft_to_eml, prescan_oft, classify_error, ERROR_NOT_FOUND, DEFAULT_MAX_EMBED_DEPTH,
+)
+
+STATUS_CONVERTED = 'converted'
+STATUS_REJECTED = 'rejected'
+STATUS_FAILED = 'failed'
+
+# How duplicate inputs share the output of their first copy
+LINK_HARDLINK = 'hardlink'
+LINK_REFLINK = 'reflink'
+LINK_MANIFEST = 'manifest'
+LINK_COPY = 'copy'  # fallback when the filesystem can't link
+DEDUPE_MODES = (LINK_HARDLINK, LINK_REFLINK, LINK_MANIFEST)
+DEDUPE_MANIFEST = 'duplicates.json'
+
+FICLONE = 0x40049409  # Linux ioctl for reflink copies
+# Errors that mean "this filesystem can't link", not "something is broken"
+LINK_FALLBACK_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY,
+                        errno.EINVAL, errno.ENOSYS, errno.EMLINK)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class BatchPlan:
+    """Pre-scan results split into files to convert and files to reject."""
+
+    accepted: list = field(default_factory=list)
+    rejected: list = field(default_factory=list)
+    output_names: dict = field(default_factory=dict)  # input path -> EML file name
+
+    @property
+    def total_input_bytes(self):
+        """Total size of the accepted input files."""
+        return sum(scan.file_size for scan in self.accepted)
+
+    @property
+    def total_work(self):
+        """Total payload bytes the accepted files will decode."""
+        return sum(scan.estimated_work for scan in self.accepted)
+
+
+@dataclass
+class FileResult:
+    """Outcome of converting one input file."""
+
+    input_path: str
+    status: str
+    output_path: str = None
+    error_category: str = None
+    error_message: str = None
+    input_bytes: int = 0
+    output_bytes: int = 0
+    attachments: int = 0
+    inline_images: int = 0
+    embedded_messages: int = 0
+    body_bytes_saved: int = 0
+    image_bytes_saved: int = 0
+    elapsed_seconds: float = 0.0
+    duplicate_of: str = None
+    link: str = None
+
+    @property
+    def ok(self):
+        """True if the file was converted."""
+        return self.status == STATUS_CONVERTED
+
+    def to_record(self):
+        """Return the JSON lines record for this result."""
+        return dict(type='file', **asdict(self))
+
+
+def collect_inputs(paths):
+    """
+    Expand a mix of files and directories into a list of OFT files.
+
+    Directories contribute their ``*.oft`` files (not recursive); files are
+    kept as given so misnamed inputs still reach the pre-scan.
+
+    Args:
+        paths (list): File and directory paths
+
+    Returns:
+        list: Input file paths
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                str(p) for p in Path(path).iterdir()
+                if p.is_file() and p.suffix.lower() == '.oft'
+            ))
+        else:
+            files.append(str(path))
+    return files
+
+
+def unique_output_names(oft_files, taken=()):
+    """
+    Give every input its own EML file name.
+
+    Inputs from different directories can share a name; the later ones get a
+    numbered name (``x.eml``, ``x_1.eml``, ...) like quarantined files do.
+    Names are compared case-insensitively for case-insensitive filesystems.
+
+    Args:
+        oft_files (list): Input paths, in the order names are handed out
+        taken (iterable): EML file names that are already in use
+
+    Returns:
+        dict: Maps each input path to its EML file name
+    """
+    used = {name.lower() for name in taken}
+    names = {}
+    for oft_file in oft_files:
+        stem = Path(oft_file).stem
+        name = f"{stem}.eml"
+        counter = 1
+        while name.lower() in used:
+            name = f"{stem}_{counter}.eml"
+            counter += 1
+        used.add(name.lower())
+        names[oft_file] = name
+    return names
+
+
+def plan_batch(oft_files):
+    """
+    Pre-scan every input and order the accepted files for conversion.
+
+    A file named more than once (for example by a directory and a file
+    argument) is only planned once, under the path it was first given as.
+
+    Args:
+        oft_files (list): Paths to the input OFT files
+
+    Returns:
+        BatchPlan: Accepted files sorted by estimated work, largest first,
+        with a unique output name for each of them
+    """
+    plan = BatchPlan()
+    unique_files = {}
+    for oft_file in oft_files:
+        unique_files.setdefault(os.path.abspath(oft_file), oft_file)
+    for oft_file in unique_files.values():
+        scan = prescan_oft(oft_file)
+        if scan.ok:
+            plan.accepted.append(scan)
+        else:
+            plan.rejected.append(scan)
+    # Hand out names in input order so they don't depend on file sizes
+    plan.output_names = unique_output_names([scan.path for scan in plan.accepted])
+
+    # Start the big files first so one of them doesn't end up last on its own
+    plan.accepted.sort(key=lambda scan: scan.estimated_work, reverse=True)
+    return plan
+
+
+def quarantine_file(oft_file, quarantine_dir):
+    """
+    Move a rejected input into the quarantine directory.
+
+    Args:
+        oft_file (str): Path to the rejected file
+        quarantine_dir (str): Directory to move it into
+
+    Returns:
+        str: New path of the file
+    """
+    os.makedirs(quarantine_dir, exist_ok=True)
+    target = Path(quarantine_dir) / Path(oft_file).name
+    counter = 1
+    while target.exists():
+        target = Path(quarantine_dir) / f"{Path(oft_file).stem}_{counter}{Path(oft_file).suffix}"
+        counter += 1
+    shutil.move(oft_file, target)
+    return str(target)
+
+
+def output_path_for(oft_file, output_dir, output_names=None):
+    """Return the EML path for an input file, using its planned name if given."""
+    name = (output_names or {}).get(oft_file) or f"{Path(oft_file).stem}.eml"
+    return os.path.join(output_dir, name)
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_duplicates(scans):
+    """
+    Find inputs that are byte-identical to an earlier input.
+
+    Only files that share their size with another file are hashed.
+
+    Args:
+        scans (list): Accepted pre-scan results, in conversion order
+
+    Returns:
+        dict: Maps each duplicate's path to the pre-scan result of the first
+        identical file
+    """
+    by_size = defaultdict(list)
+    for scan in scans:
+        by_size[scan.file_size].append(scan)
+
+    duplicates = {}
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        first_by_digest = {}
+        for scan in group:
+            original = first_by_digest.setdefault(file_digest(scan.path), scan)
+            if original is not scan:
+                duplicates[scan.path] = original
+    return duplicates
+
+
+def reflink_file(source, target):
+    """Create ``target`` as a copy-on-write clone of ``source`` (Linux only)."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+
+def link_output(source, target, mode):
+    """
+    Make ``target`` share the contents of ``source``.
+
+    The link is created under a temporary name and then renamed over
+    ``target``, so an existing ``target`` is replaced rather than written
+    into. Falls back to a plain copy when the filesystem can't link
+    (different devices, no reflink support, no hard links).
+
+    Args:
+        source (str): Existing EML file
+        target (str): Path to create; replaced if it exists
+        mode (str): LINK_HARDLINK or LINK_REFLINK
+
+    Returns:
+        str: The method actually used
+
+    Raises:
+        ValueError: If ``target`` is ``source`` itself
+    """
+    if os.path.abspath(source) == os.path.abspath(target):
+        raise ValueError(f"Refusing to link {source} onto itself")
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return mode  # Linked by an earlier run
+    directory, name = os.path.split(os.path.abspath(target))
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        try:
+            if mode == LINK_HARDLINK:
+                os.link(source, temp_path)
+            else:
+                reflink_file(source, temp_path)
+            method = mode
+        except OSError as e:
+            if e.errno not in LINK_FALLBACK_ERRNOS:
+                raise
+            shutil.copyfile(source, temp_path)
+            method = LINK_COPY
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+    return method
+
+
+def duplicate_result(scan, original, output_path, mode):
+    """
+    Build the result for a duplicate input without converting it.
+
+    Args:
+        scan (PrescanResult): Pre-scan result of the duplicate
+        original (FileResult): Result of the identical file converted earlier
+        output_path (str): Where the duplicate's EML file goes
+        mode (str): One of DEDUPE_MODES
+
+    Returns:
+        FileResult: Copies the original's status and counts
+    """
+    start = time.perf_counter()
+    result = FileResult(
+        input_path=scan.path,
+        status=original.status,
+        error_category=original.error_category,
+        error_message=original.error_message,
+        input_bytes=scan.file_size,
+        attachments=original.attachments,
+        inline_images=original.inline_images,
+        embedded_messages=original.embedded_messages,
+        body_bytes_saved=original.body_bytes_saved,
+        image_bytes_saved=original.image_bytes_saved,
+        duplicate_of=original.input_path,
+    )
+    if original.ok:
+        result.output_bytes = original.output_bytes
+        if mode == LINK_MANIFEST:
+            result.output_path = original.output_path
+            result.link = LINK_MANIFEST
+        else:
+            result.output_path = output_path
+            try:
+                result.link = link_output(original.output_path, result.output_path, mode)
+            except OSError as e:
+                result.status = STATUS_FAILED
+                result.output_path = None
+                result.error_category = classify_error(e)
+                result.error_message = str(e)
+    result.elapsed_seconds = round(time.perf_counter() - start, 6)
+    return result
+
+
+def rejected_result(scan):
+    """Build the result for an input that failed the pre-scan."""
+    return FileResult(
+        input_path=scan.path,
+        status=STATUS_REJECTED,
+        error_category=scan.error_category,
+        error_message=scan.error_message,
+        input_bytes=scan.file_size,
+    )
+
+
+def convert_file(scan, output_dir, options=None, output_path=None):
+    """
+    Convert one pre-scanned input and record the outcome.
+
+    Args:
+        scan (PrescanResult): Accepted pre-scan result for the input
+        output_dir (str): Directory for the EML file
+        options (dict): Extra keyword arguments for convert_oft_to_eml()
+        output_path (str): EML path to use instead of ``<stem>.eml`` in
+            ``output_dir`` (optional)
+
+    Returns:
+        FileResult: The outcome; conversion errors are recorded, not raised
+    """
+    result = FileResult(input_path=scan.path, status=STATUS_CONVERTED,
+                        input_bytes=scan.file_size)
+    if output_path is None:
+        output_path = output_path_for(scan.path, output_dir)
+    stats = {}
+    start = time.perf_counter()
+    try:
+        result.output_path = convert_oft_to_eml(scan.path, output_path, stats=stats,
+                                                **(options or {}))
+        result.output_bytes = os.path.getsize(result.output_path)
+    except Exception as e:
+        result.status = STATUS_FAILED
+        result.error_category = classify_error(e)
+        result.error_message = str(e)
+    result.elapsed_seconds = round(time.perf_counter() - start, 6)
+    result.attachments = stats.get('attachments', 0)
+    result.inline_images = stats.get('inline_images', 0)
+    result.embedded_messages = stats.get('embedded_messages', 0)
+    result.body_bytes_saved = stats.get('body_bytes_saved', 0)
+    result.image_bytes_saved = stats.get('image_bytes_saved', 0)
+    return result
+
+
+def summarize_results(results, elapsed_seconds):
+    """
+    Aggregate per-file results into a batch summary.
+
+    Args:
+        results (list): FileResult objects
+        elapsed_seconds (float): Wall-clock time of the whole batch
+
+    Returns:
+        dict: The ``summary`` record
+    """
+    statuses = Counter(result.status for result in results)
+    converted = [result for result in results if result.ok]
+    duplicates = [result for result in converted if result.duplicate_of]
+    input_bytes = sum(result.input_bytes for result in converted)
+    return {
+        'type': 'summary',
+        'total': len(results),
+        'converted': statuses[STATUS_CONVERTED],
+        'rejected': statuses[STATUS_REJECTED],
+        'failed': statuses[STATUS_FAILED],
+        'errors': dict(Counter(r.error_category for r in results if r.error_category)),
+        'input_bytes': input_bytes,
+        # Manifest entries share the original's file and write nothing
+        'output_bytes': sum(result.output_bytes for result in converted
+                            if result.link != LINK_MANIFEST),
+        'attachments': sum(result.attachments for result in converted),
+        'inline_images': sum(result.inline_images for result in converted),
+        'embedded_messages': sum(result.embedded_messages for result in converted),
+        'body_bytes_saved': sum(result.body_bytes_saved for result in converted
+                                if not result.duplicate_of),
+        'image_bytes_saved': sum(result.image_bytes_saved for result in converted
+                                 if not result.duplicate_of),
+        'duplicates': len(duplicates),
+        'dedupe_saved_bytes': sum(result.output_bytes for result in duplicates
+                                  if result.link != LINK_COPY),
+        'elapsed_seconds': round(elapsed_seconds, 6),
+        'files_per_second': round(len(converted) / elapsed_seconds, 3) if elapsed_seconds else 0.0,
+        'input_bytes_per_second': round(input_bytes / elapsed_seconds) if elapsed_seconds else 0,
+    }
+
+
+def write_record(report, record):
+    """Write one JSON lines record and flush it so readers see it immediately."""
+    report.write(json.dumps(record) + '\n')
+    report.flush()
+
+
+def load_failed_inputs(report_path):
+    """
+    Read a previous JSON lines report and return the inputs to retry.
+
+    Args:
+        report_path (str): Path to the report
+
+    Returns:
+        list: Input paths whose last recorded status was not ``converted``
+    """
+    last_status = {}
+    with open(report_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('type') == 'file':
+                last_status[record['input_path']] = record['status']
+    return [path for path, status in last_status.items() if status != STATUS_CONVERTED]
+
+
+def convert_batch(oft_files, output_dir, quarantine_dir=None, report=None, dedupe=None,
+                  options=None):
+    """
+    Convert a list of OFT files into ``output_dir``.
+
+    Args:
+        oft_files (list): Paths to the input OFT files
+        output_dir (str): Directory for the EML files
+        quarantine_dir (str): Where to move rejected inputs (optional)
+        report (file): Text stream for the JSON lines report (optional)
+        dedupe (str): One of DEDUPE_MODES to convert identical inputs only
+            once (optional)
+        options (dict): Extra keyword arguments for convert_oft_to_eml()
+
+    Returns:
+        tuple: ``(results, summary)`` with one FileResult per distinct input
+        and the summary record
+    """
+    start = time.perf_counter()
+    plan = plan_batch(oft_files)
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+
+    def record(result):
+        results.append(result)
+        if report is not None:
+            write_record(report, result.to_record())
+
+    for scan in plan.rejected:
+        print(f"Rejected {scan.path} ({scan.error_category}): {scan.error_message}")
+        if quarantine_dir and scan.error_category != ERROR_NOT_FOUND:
+            quarantine_file(scan.path, quarantine_dir)
+        record(rejected_result(scan))
+
+    duplicates = find_duplicates(plan.accepted) if dedupe else {}
+    originals = {}
+    manifest = {}
+    for scan in plan.accepted:
+        output_path = output_path_for(scan.path, output_dir, plan.output_names)
+        if scan.path in duplicates:
+            result = duplicate_result(scan, originals[duplicates[scan.path].path],
+                                      output_path, dedupe)
+            print(f"Duplicate of {result.duplicate_of}: {scan.path}")
+            if result.link == LINK_MANIFEST:
+                manifest[scan.path] = result.output_path
+        else:
+            result = convert_file(scan, output_dir, options, output_path)
+            originals[scan.path] = result
+        record(result)
+
+    if manifest:
+        with open(os.path.join(output_dir, DEDUPE_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    summary = summarize_results(results, time.perf_counter() - start)
+    if report is not None:
+        write_record(report, summary)
+    return results, summary
+
+
+def print_plan(plan):
+    """Print the pre-scan triage for a batch."""
+    print(f"Accepted: {len(plan.accepted)} files, "
+          f"{plan.total_input_bytes} bytes, ~{plan.total_work} payload bytes to decode")
+    for scan in plan.accepted:
+        print(f"  {scan.path} [{scan.kind}] {scan.file_size} bytes, "
+              f"{scan.attachment_count} attachments, work {scan.estimated_work}")
+    print(f"Rejected: {len(plan.rejected)} files")
+    for scan in plan.rejected:
+        print(f"  {scan.path} ({scan.error_category}): {scan.error_message}")
+
+
+def main():
+    """Main entry point for the batch converter."""
+    parser = argparse.ArgumentParser(description="Convert many OFT files to EML.")
+    parser.add_argument('inputs', nargs='*', help="OFT files or directories containing them")
+    parser.add_argument('-o', '--output-dir', default='.', help="Directory for the EML files")
+    parser.add_argument('--quarantine', metavar='DIR',
+                        help="Move inputs that fail the pre-scan into DIR")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only pre-scan the inputs and print the plan")
+    parser.add_argument('--report', metavar='FILE',
+                        help="Stream JSON lines results to FILE ('-' for stdout)")
+    parser.add_argument('--dedupe', choices=DEDUPE_MODES,
+                        help="Convert identical inputs once and link or list the copies")
+    parser.add_argument('--fast-bodies', action='store_true',
+                        help="Pass bodies through as bytes and pick the smallest transfer encoding")
+    parser.add_argument('--optimize-images', action='store_true',
+                        help="Losslessly re-pack inline PNG images")
+    parser.add_argument('--max-embed-depth', type=int, default=DEFAULT_MAX_EMBED_DEPTH,
+                        help="Deepest level of embedded messages to convert")
+    parser.add_argument('--retry-from', metavar='REPORT',
+                        help="Also convert the inputs that did not convert in REPORT")
+    args = parser.parse_args()
+
+    oft_files = collect_inputs(args.inputs)
+    if args.retry_from:
+        oft_files.extend(path for path in load_failed_inputs(args.retry_from)
+                         if path not in oft_files)
+    if not oft_files:
+        parser.error("no input files given")
+
+    if args.dry_run:
+        plan = plan_batch(oft_files)
+        print_plan(plan)
+        sys.exit(1 if plan.rejected else 0)
+
+    options = {'fast_bodies': args.fast_bodies, 'optimize_images': args.optimize_images,
+               'max_embed_depth': args.max_embed_depth}
+    if args.report == '-':
+        # Keep stdout clean for the report; progress messages go to stderr
+        report = sys.stdout
+        with redirect_stdout(sys.stderr):
+            results, summary = convert_batch(oft_files, args.output_dir, args.quarantine,
+                                             report=report, dedupe=args.dedupe, options=options)
+    elif args.report:
+        with open(args.report, 'w', encoding='utf-8') as report:
+            results, summary = convert_batch(oft_files, args.output_dir, args.quarantine,
+                                             report=report, dedupe=args.dedupe, options=options)
+    else:
+        results, summary = convert_batch(oft_files, args.output_dir, args.quarantine,
+                                         dedupe=args.dedupe, options=options)
+
+    out = sys.stderr if args.report == '-' else sys.stdout
+    print(f"\nBatch complete: {summary['converted']}/{summary['total']} files converted "
+          f"in {summary['elapsed_seconds']:.2f}s ({summary['files_per_second']} files/s)",
+          file=out)
+    if args.fast_bodies:
+        print(f"Body encoding saved {summary['body_bytes_saved']} bytes versus base64", file=out)
+    if args.optimize_images:
+        print(f"Image re-packing saved {summary['image_bytes_saved']} bytes", file=out)
+    sys.exit(0 if summary['converted'] == summary['total'] else 1)
+
+
+if __name__ == "__main__":
+    main()
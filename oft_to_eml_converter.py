@@ -11,108 +11,785 @@ Usage:
 
 import sys
 import os
+import re
+import base64
+import binascii
+import codecs
+import struct
+import uuid
+import zlib
+from dataclasses import dataclass
 from pathlib import Path
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
+from email.mime.nonmultipart import MIMENonMultipart
+from email.mime.message import MIMEMessage
 from email import encoders
 import extract_msg
+import olefile
+from olefile.olefile import OleFileError, NotOleFileError
 
 
-def convert_oft_to_eml(oft_file_path, eml_file_path=None):
+# OLE compound file signature (first 8 bytes of every OFT/MSG file)
+OLE_SIGNATURE = b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'
+OLE_HEADER_SIZE = 512
+
+# Root storage CLSIDs: templates and regular messages share the MSG format
+OFT_CLSID = '0006F046-0000-0000-C000-000000000046'
+MSG_CLSID = '00020D0B-0000-0000-C000-000000000046'
+
+# Error categories reported by prescan_oft() and classify_error()
+ERROR_NOT_FOUND = 'not_found'
+ERROR_EMPTY = 'empty'
+ERROR_NOT_OLE = 'not_ole'
+ERROR_TRUNCATED = 'truncated'
+ERROR_BAD_DIRECTORY = 'bad_directory'
+ERROR_NOT_OUTLOOK = 'not_outlook_item'
+ERROR_PARSE = 'parse_error'
+ERROR_IO = 'io_error'
+ERROR_UNKNOWN = 'unknown'
+
+# MSG stream names used for size estimates
+PROPERTIES_STREAM = '__properties_version1.0'
+BODY_STREAMS = ('__substg1.0_1000001F', '__substg1.0_1000001E')
+HTML_STREAMS = ('__substg1.0_10130102', '__substg1.0_1013001F', '__substg1.0_1013001E')
+RTF_STREAM = '__substg1.0_10090102'
+ATTACHMENT_DATA_STREAM = '__substg1.0_37010102'
+
+# PR_INTERNET_CPID: code page of the HTML body stream
+PR_INTERNET_CPID = '3FDE0003'
+
+# Windows code pages whose bodies can be passed through as bytes. All of them
+# are ASCII compatible, so line endings can be normalized without decoding.
+CODEPAGE_CHARSETS = {
+    65001: 'utf-8',
+    20127: 'us-ascii',
+    1250: 'windows-1250', 1251: 'windows-1251', 1252: 'windows-1252',
+    1253: 'windows-1253', 1254: 'windows-1254', 1255: 'windows-1255',
+    1256: 'windows-1256', 1257: 'windows-1257', 1258: 'windows-1258',
+    28591: 'iso-8859-1', 28592: 'iso-8859-2', 28593: 'iso-8859-3',
+    28594: 'iso-8859-4', 28595: 'iso-8859-5', 28596: 'iso-8859-6',
+    28597: 'iso-8859-7', 28598: 'iso-8859-8', 28599: 'iso-8859-9',
+    28605: 'iso-8859-15',
+    20866: 'koi8-r', 21866: 'koi8-u',
+    932: 'shift_jis', 50220: 'iso-2022-jp', 51932: 'euc-jp',
+    936: 'gb2312', 54936: 'gb18030', 949: 'euc-kr', 950: 'big5',
+}
+
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+META_CHARSET_SCAN_BYTES = 4096
+
+# Bytes that quoted-printable leaves as they are
+QP_SAFE_BYTES = bytes(b for b in range(33, 127) if b != ord('=')) + b' \t\n'
+MAX_7BIT_LINE = 998
+
+# Magic-byte signatures, matched against the start of attachment data
+MAGIC_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'%PDF-', 'application/pdf'),
+    (b'{\\rtf', 'application/rtf'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'PK\x03\x04', 'application/zip'),
+    (OLE_SIGNATURE, 'application/x-ole-storage'),
+)
+SNIFF_BYTES = 32
+# Valid BMP info header sizes (offset 14), to tell BMP apart from text starting "BM"
+BMP_HEADER_SIZES = (12, 40, 52, 56, 108, 124)
+# ICO header ("\0\0\1\0" + image count) and directory entry sizes. The
+# signature alone is too weak, so the first directory entry is checked too.
+ICO_SIGNATURE = b'\x00\x00\x01\x00'
+ICO_HEADER_SIZE = 6
+ICO_ENTRY_SIZE = 16
+# Sniffed types that are containers for many formats; the extension is more specific
+CONTAINER_MIME_TYPES = ('application/zip', 'application/x-ole-storage')
+
+EXTENSION_MIME_TYPES = {
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.jpe': 'image/jpeg',
+    '.gif': 'image/gif', '.bmp': 'image/bmp', '.webp': 'image/webp',
+    '.tif': 'image/tiff', '.tiff': 'image/tiff', '.ico': 'image/x-icon',
+    '.svg': 'image/svg+xml', '.emf': 'image/emf', '.wmf': 'image/wmf',
+    '.txt': 'text/plain', '.htm': 'text/html', '.html': 'text/html', '.css': 'text/css',
+    '.csv': 'text/csv', '.ics': 'text/calendar', '.vcf': 'text/vcard', '.xml': 'text/xml',
+    '.pdf': 'application/pdf', '.rtf': 'application/rtf', '.zip': 'application/zip',
+    '.gz': 'application/gzip', '.json': 'application/json',
+    '.doc': 'application/msword', '.dot': 'application/msword',
+    '.xls': 'application/vnd.ms-excel', '.ppt': 'application/vnd.ms-powerpoint',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.msg': 'application/vnd.ms-outlook', '.oft': 'application/vnd.ms-outlook',
+}
+
+PNG_SIGNATURE = MAGIC_SIGNATURES[0][0]
+# Chunks that only carry metadata; dropping them leaves the pixels unchanged
+PNG_METADATA_CHUNKS = (b'tEXt', b'zTXt', b'iTXt', b'tIME')
+# Don't re-pack images whose pixel data would inflate beyond this
+MAX_PNG_RAW_BYTES = 64 * 1024 * 1024
+
+# Limits for converting embedded messages (.msg inside .oft) to message/rfc822
+DEFAULT_MAX_EMBED_DEPTH = 8
+DEFAULT_MAX_EMBED_BYTES = 100 * 1024 * 1024
+
+
+class OFTValidationError(ValueError):
+    """Raised when an input file fails the OFT pre-scan."""
+
+    def __init__(self, message, category=ERROR_UNKNOWN):
+        super().__init__(message)
+        self.category = category
+
+
+@dataclass
+class PrescanResult:
+    """Outcome of a cheap structural check of an OFT file."""
+
+    path: str
+    ok: bool = False
+    error_category: str = None
+    error_message: str = None
+    kind: str = None  # 'template', 'message' or 'unknown'
+    clsid: str = None
+    file_size: int = 0
+    stream_count: int = 0
+    attachment_count: int = 0
+    recipient_count: int = 0
+    body_bytes: int = 0
+    html_bytes: int = 0
+    rtf_bytes: int = 0
+    attachment_bytes: int = 0
+
+    @property
+    def estimated_work(self):
+        """Number of payload bytes the converter will have to decode."""
+        return self.body_bytes + self.html_bytes + self.rtf_bytes + self.attachment_bytes
+
+    def fail(self, category, message):
+        """Mark the result as rejected and return it."""
+        self.ok = False
+        self.error_category = category
+        self.error_message = message
+        return self
+
+
+def prescan_oft(oft_file_path):
+    """
+    Check that a file looks like a readable OFT/MSG file without decoding it.
+
+    Only the OLE header and directory are read; body and attachment streams
+    are sized but never opened.
+
+    Args:
+        oft_file_path (str): Path to the input OFT file
+
+    Returns:
+        PrescanResult: ``ok`` is False and ``error_category`` is set when the
+        file should be rejected
+    """
+    result = PrescanResult(path=str(oft_file_path))
+
+    if not os.path.exists(oft_file_path):
+        return result.fail(ERROR_NOT_FOUND, f"Input file not found: {oft_file_path}")
+
+    try:
+        result.file_size = os.path.getsize(oft_file_path)
+        if result.file_size == 0:
+            return result.fail(ERROR_EMPTY, "File is empty")
+
+        with open(oft_file_path, 'rb') as f:
+            header = f.read(OLE_HEADER_SIZE)
+    except OSError as e:
+        return result.fail(ERROR_IO, f"Cannot read file: {e}")
+
+    if not header.startswith(OLE_SIGNATURE):
+        return result.fail(ERROR_NOT_OLE, "Not an OLE compound file (bad signature)")
+    if len(header) < OLE_HEADER_SIZE:
+        return result.fail(ERROR_TRUNCATED, f"File ends inside the OLE header ({len(header)} bytes)")
+
+    # Header fields: sector shift, FAT sector count and first directory sector
+    sector_shift = struct.unpack_from('<H', header, 30)[0]
+    if sector_shift not in (9, 12):
+        return result.fail(ERROR_BAD_DIRECTORY, f"Invalid sector shift: {sector_shift}")
+    sector_size = 1 << sector_shift
+    num_fat_sectors, first_dir_sector = struct.unpack_from('<II', header, 44)
+    declared_min_size = sector_size * (1 + num_fat_sectors + 1)
+    if first_dir_sector < 0xFFFFFFFA:
+        declared_min_size = max(declared_min_size, sector_size * (first_dir_sector + 2))
+    if result.file_size < declared_min_size:
+        return result.fail(
+            ERROR_TRUNCATED,
+            f"File is {result.file_size} bytes but header declares at least {declared_min_size}")
+
+    try:
+        ole = olefile.OleFileIO(oft_file_path)
+    except Exception as e:
+        return result.fail(ERROR_BAD_DIRECTORY, f"Unreadable OLE directory: {e}")
+
+    try:
+        # Every sector the FAT uses must be in the file; a cut-off copy or
+        # download fails here without reading any stream
+        missing = sum(1 for sector in ole.fat if ole.nb_sect <= sector <= olefile.MAXREGSECT)
+        if missing:
+            return result.fail(
+                ERROR_TRUNCATED,
+                f"FAT refers to {missing} sectors past the end of the file "
+                f"({ole.nb_sect} sectors)")
+
+        result.clsid = ole.root.clsid or None
+        if result.clsid == OFT_CLSID:
+            result.kind = 'template'
+        elif result.clsid == MSG_CLSID:
+            result.kind = 'message'
+        elif result.clsid is None:
+            # Some third-party writers leave the root CLSID blank
+            result.kind = 'unknown'
+        else:
+            return result.fail(ERROR_NOT_OUTLOOK, f"Unexpected root CLSID: {result.clsid}")
+
+        if not ole.exists(PROPERTIES_STREAM):
+            return result.fail(ERROR_NOT_OUTLOOK, f"Missing {PROPERTIES_STREAM} stream")
+
+        attachments = set()
+        recipients = set()
+        for entry in ole.listdir(streams=True, storages=False):
+            size = ole.get_size(entry)
+            if size > result.file_size:
+                return result.fail(
+                    ERROR_TRUNCATED,
+                    f"Stream {'/'.join(entry)} declares {size} bytes, larger than the file")
+            result.stream_count += 1
+            top = entry[0]
+            if top.startswith('__attach_version1.0_'):
+                attachments.add(top)
+                if len(entry) == 2 and entry[1] == ATTACHMENT_DATA_STREAM:
+                    result.attachment_bytes += size
+            elif top.startswith('__recip_version1.0_'):
+                recipients.add(top)
+            elif len(entry) == 1:
+                if top in BODY_STREAMS:
+                    result.body_bytes += size
+                elif top in HTML_STREAMS:
+                    result.html_bytes += size
+                elif top == RTF_STREAM:
+                    result.rtf_bytes += size
+        result.attachment_count = len(attachments)
+        result.recipient_count = len(recipients)
+    finally:
+        ole.close()
+
+    result.ok = True
+    return result
+
+
+def classify_error(error):
+    """
+    Map an exception raised during conversion to an error category.
+
+    Args:
+        error (Exception): The exception to classify
+
+    Returns:
+        str: One of the ``ERROR_*`` category constants
+    """
+    if isinstance(error, OFTValidationError):
+        return error.category
+    if isinstance(error, FileNotFoundError):
+        return ERROR_NOT_FOUND
+    if isinstance(error, extract_msg.exceptions.InvalidFileFormatError):
+        return ERROR_NOT_OUTLOOK
+    # olefile's errors subclass OSError but mean the file itself is corrupt
+    if isinstance(error, NotOleFileError):
+        return ERROR_NOT_OLE
+    if isinstance(error, OleFileError):
+        return ERROR_BAD_DIRECTORY
+    if isinstance(error, OSError):
+        return ERROR_IO
+    if isinstance(error, (ValueError, TypeError, KeyError, IndexError, struct.error)):
+        return ERROR_PARSE
+    return ERROR_UNKNOWN
+
+
+def base64_size(length):
+    """Size of ``length`` bytes after base64 encoding with 76 character lines."""
+    encoded = 4 * ((length + 2) // 3)
+    return encoded + (encoded + 75) // 76
+
+
+def choose_transfer_encoding(data):
+    """
+    Pick the smallest Content-Transfer-Encoding for a text body.
+
+    Args:
+        data (bytes): Body in an ASCII-compatible charset with LF line endings
+
+    Returns:
+        str: '7bit', 'quoted-printable' or 'base64'
+    """
+    if data.isascii() and b'\r' not in data and b'\0' not in data and \
+            max(len(line) for line in data.split(b'\n')) <= MAX_7BIT_LINE:
+        return '7bit'
+    # Each escaped byte becomes "=XX"; allow one soft line break per 75 bytes
+    escaped = len(data.translate(None, QP_SAFE_BYTES))
+    qp_size = len(data) + 2 * escaped + 2 * (len(data) // 75)
+    return 'quoted-printable' if qp_size <= base64_size(len(data)) else 'base64'
+
+
+def make_text_part(data, subtype, charset):
+    """
+    Build a text part from already encoded bytes without decoding them.
+
+    Args:
+        data (bytes): Body encoded in ``charset``
+        subtype (str): 'plain' or 'html'
+        charset (str): MIME charset of ``data`` (must be ASCII compatible)
+
+    Returns:
+        tuple: ``(part, transfer_encoding)``
+    """
+    data = data.replace(b'\r\n', b'\n')
+    encoding = choose_transfer_encoding(data)
+    if encoding == '7bit':
+        payload = data.decode('ascii')
+    elif encoding == 'quoted-printable':
+        payload = binascii.b2a_qp(data).decode('ascii')
+    else:
+        payload = base64.encodebytes(data).decode('ascii')
+
+    part = MIMENonMultipart('text', subtype, charset=charset)
+    part.set_payload(payload)
+    part['Content-Transfer-Encoding'] = encoding
+    return part, encoding
+
+
+def sniff_mime_type(data):
+    """
+    Identify common file formats from their first bytes.
+
+    Args:
+        data (bytes): File contents (only the first bytes are examined)
+
+    Returns:
+        str: MIME type, or None if the format isn't recognized
+    """
+    head = bytes(data[:SNIFF_BYTES])
+    for signature, mime_type in MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:2] == b'BM' and len(head) >= 18 and \
+            struct.unpack_from('<I', head, 14)[0] in BMP_HEADER_SIZES:
+        return 'image/bmp'
+    if head.startswith(ICO_SIGNATURE) and is_ico_directory(head, len(data)):
+        return 'image/x-icon'
+    return None
+
+
+def is_ico_directory(head, size):
+    """
+    Check that an ICO header and its first directory entry are plausible.
+
+    Args:
+        head (bytes): First bytes of the file
+        size (int): Total file size
+
+    Returns:
+        bool: True if the image count and first entry fit the file
+    """
+    if len(head) < ICO_HEADER_SIZE + ICO_ENTRY_SIZE:
+        return False
+    count = struct.unpack_from('<H', head, 4)[0]
+    directory_end = ICO_HEADER_SIZE + ICO_ENTRY_SIZE * count
+    if count == 0 or directory_end > size:
+        return False
+    reserved, planes, bit_count, image_size, offset = struct.unpack_from(
+        '<xxxBHHII', head, ICO_HEADER_SIZE)
+    return (reserved == 0 and planes in (0, 1) and bit_count in (0, 1, 4, 8, 16, 24, 32)
+            and image_size > 0 and offset >= directory_end and offset + image_size <= size)
+
+
+def guess_mime_type(filename, data):
+    """
+    Get the MIME type of an attachment.
+
+    The content is trusted over the extension, except for container formats
+    (ZIP, OLE) where the extension tells e.g. .docx and .zip apart.
+
+    Args:
+        filename (str): Attachment filename
+        data (bytes): Attachment contents
+
+    Returns:
+        str: MIME type, ``application/octet-stream`` if unknown
+    """
+    sniffed = sniff_mime_type(data) if isinstance(data, (bytes, bytearray)) else None
+    if sniffed and sniffed not in CONTAINER_MIME_TYPES:
+        return sniffed
+    extension = os.path.splitext(filename)[1].lower()
+    return EXTENSION_MIME_TYPES.get(extension) or sniffed or 'application/octet-stream'
+
+
+def repack_png(data):
+    """
+    Losslessly shrink a PNG by recompressing its pixel data and dropping
+    text and timestamp chunks.
+
+    Args:
+        data (bytes): PNG file contents
+
+    Returns:
+        bytes: The re-packed PNG, or ``data`` unchanged if it was not smaller
+        or could not be parsed
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+
+    chunks = []
+    idat = []
+    pos = len(PNG_SIGNATURE)
+    try:
+        while pos < len(data):
+            length, chunk_type = struct.unpack_from('>I4s', data, pos)
+            body = data[pos + 8:pos + 8 + length]
+            if len(body) != length:
+                return data
+            pos += 12 + length
+            if chunk_type == b'IDAT':
+                if not idat:
+                    chunks.append((chunk_type, None))  # Placeholder for the merged IDAT
+                idat.append(body)
+            elif chunk_type not in PNG_METADATA_CHUNKS:
+                chunks.append((chunk_type, body))
+            if chunk_type == b'IEND':
+                break
+        if not idat:
+            return data
+        decompressor = zlib.decompressobj()
+        pixels = decompressor.decompress(b''.join(idat), MAX_PNG_RAW_BYTES)
+        if decompressor.unconsumed_tail:
+            return data
+    except (struct.error, zlib.error):
+        return data
+
+    compressed = zlib.compress(pixels, 9)
+    out = [PNG_SIGNATURE]
+    for chunk_type, body in chunks:
+        if body is None:
+            body = compressed
+        out.append(struct.pack('>I', len(body)) + chunk_type + body +
+                   struct.pack('>I', zlib.crc32(chunk_type + body) & 0xFFFFFFFF))
+    repacked = b''.join(out)
+    return repacked if len(repacked) < len(data) else data
+
+
+def html_body_bytes(msg):
+    """
+    Get the HTML body as stored, and its charset if it can be determined.
+
+    The raw HTML stream is used when present, so the body is never decoded.
+    Otherwise the body extract_msg builds (from RTF or plain text) is used.
+
+    Args:
+        msg: The extract_msg message
+
+    Returns:
+        tuple: ``(html_bytes, charset)``; ``charset`` is None if unknown
+    """
+    charset = None
+    html = msg.getStream(HTML_STREAMS[0])
+    if html is not None:
+        charset = CODEPAGE_CHARSETS.get(msg.getPropertyVal(PR_INTERNET_CPID))
+    else:
+        html = msg.htmlBody
+    if not html:
+        return html, None
+
+    if charset is None:
+        match = META_CHARSET_RE.search(html[:META_CHARSET_SCAN_BYTES])
+        if match:
+            try:
+                name = match.group(1).decode('ascii')
+                if codecs.lookup(name).name not in ('utf-16', 'utf-16-le', 'utf-16-be', 'utf-32'):
+                    charset = name.lower()
+            except LookupError:
+                pass
+    if charset is None and html.isascii():
+        charset = 'us-ascii'
+    return html, charset
+
+
+def write_file_atomic(path, text):
+    """
+    Write a text file through a temporary file in the same directory.
+
+    The finished file replaces ``path`` in one step, so readers never see a
+    partial file, and other hard links to the old file keep their contents
+    instead of being truncated with it.
+
+    Args:
+        path (str): File to create or replace
+        text (str): Contents, written as UTF-8
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp_path, 'x', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def limited_attachments(msg, stats, max_embed_bytes):
+    """
+    Load the attachments of an embedded message one at a time.
+
+    extract_msg reads attachment data as soon as an attachment is loaded, so
+    the size of each data stream is first taken from the OLE directory.
+    Attachments that would take the embedded content past ``max_embed_bytes``
+    once base64 encoded are never read; they are counted in
+    ``skipped_attachments``. Embedded messages have no data stream and are
+    checked by the caller.
+
+    Args:
+        msg: The embedded extract_msg message
+        stats (dict): Counters, see convert_oft_to_eml()
+        max_embed_bytes (int): Encoded bytes allowed in embedded messages
+
+    Yields:
+        The loaded attachments
+    """
+    # Only the message's own storage is listed, not the whole OLE directory
+    storages = sorted(entry.name for entry in msg._getOleEntry('/').kids
+                      if entry.entry_type == olefile.STGTY_STORAGE
+                      and entry.name.startswith('__attach'))
+    for storage in storages:
+        data_stream = f'{storage}/{ATTACHMENT_DATA_STREAM}'
+        if msg.exists(data_stream):
+            size = msg._getOleEntry(data_stream).size
+            if stats['embedded_bytes'] + base64_size(size) > max_embed_bytes:
+                print(f"  Skipped attachment of {size} bytes (embedded size limit reached)")
+                stats['skipped_attachments'] += 1
+                continue
+        yield msg.initAttachmentFunc(msg, storage)
+
+
+def is_embedded_message(attachment):
+    """Return True if an attachment is an embedded Outlook message."""
+    return isinstance(getattr(attachment, 'data', None), extract_msg.MSGFile)
+
+
+def build_mime_message(msg, stats, fast_bodies=False, optimize_images=False,
+                       max_embed_depth=DEFAULT_MAX_EMBED_DEPTH,
+                       max_embed_bytes=DEFAULT_MAX_EMBED_BYTES, depth=0):
+    """
+    Build the MIME message for an extract_msg message and its attachments.
+
+    Embedded messages are converted recursively into ``message/rfc822``
+    parts, reading from the same open OLE file as their parent.
+
+    Args:
+        msg: The extract_msg message
+        stats (dict): Counters, see convert_oft_to_eml()
+        fast_bodies (bool): See convert_oft_to_eml()
+        optimize_images (bool): See convert_oft_to_eml()
+        max_embed_depth (int): Deepest level of embedded messages to convert
+        max_embed_bytes (int): Total encoded body and attachment bytes
+            allowed in embedded messages
+        depth (int): Nesting level of ``msg`` (0 for the template itself)
+
+    Returns:
+        MIMEMultipart: The converted message
+    """
+    # Create MIME message - use 'related' to support inline images
+    mime_msg = MIMEMultipart('related')
+    
+    # Set headers
+    if msg.sender:
+        mime_msg['From'] = msg.sender
+    if msg.to:
+        mime_msg['To'] = msg.to
+    if msg.cc:
+        mime_msg['Cc'] = msg.cc
+    if msg.subject:
+        mime_msg['Subject'] = msg.subject
+    if msg.date:
+        mime_msg['Date'] = msg.date.strftime('%a, %d %b %Y %H:%M:%S %z') if hasattr(msg.date, 'strftime') else str(msg.date)
+    
+    # Create alternative container for text/html content
+    msg_alternative = MIMEMultipart('alternative')
+    
+    # Add message body
+    if msg.body:
+        if fast_bodies:
+            data = msg.body.encode('utf-8')
+            text_part, encoding = make_text_part(data, 'plain', 'utf-8')
+            stats['body_bytes_saved'] += base64_size(len(data)) - len(text_part.get_payload())
+            print(f"  Plain text body: {encoding}")
+        else:
+            text_part = MIMEText(msg.body, 'plain', 'utf-8')
+        msg_alternative.attach(text_part)
+        if depth:
+            stats['embedded_bytes'] += len(text_part.get_payload())
+    
+    html, html_charset = html_body_bytes(msg) if fast_bodies else (None, None)
+    if html_charset:
+        html_part, encoding = make_text_part(html, 'html', html_charset)
+        stats['body_bytes_saved'] += base64_size(len(html)) - len(html_part.get_payload())
+        print(f"  HTML body: {html_charset}, {encoding}")
+        msg_alternative.attach(html_part)
+    elif msg.htmlBody:
+        html_part = MIMEText(msg.htmlBody, 'html', 'utf-8')
+        msg_alternative.attach(html_part)
+    else:
+        html_part = None
+    if depth and html_part is not None:
+        stats['embedded_bytes'] += len(html_part.get_payload())
+    
+    # Add the alternative part to the main message
+    mime_msg.attach(msg_alternative)
+    
+    # Add attachments if any. Inside embedded messages they are loaded one
+    # by one so that data past the size limit is never read.
+    if depth:
+        attachments = limited_attachments(msg, stats, max_embed_bytes)
+    else:
+        attachments = msg.attachments or []
+        if attachments:
+            print(f"Found {len(attachments)} attachments")
+    for attachment in attachments:
+        if is_embedded_message(attachment):
+            embedded = attachment.data
+            filename = (attachment.longFilename or attachment.shortFilename or
+                        embedded.subject or "embedded message")
+            if not filename.lower().endswith('.eml'):
+                filename += '.eml'
+            
+            if depth + 1 > max_embed_depth:
+                print(f"  Skipped embedded message: {filename} (deeper than {max_embed_depth} levels)")
+                stats['skipped_embedded'] += 1
+                continue
+            if stats['embedded_bytes'] >= max_embed_bytes:
+                print(f"  Skipped embedded message: {filename} (embedded size limit reached)")
+                stats['skipped_embedded'] += 1
+                continue
+            
+            print(f"  Converting embedded message (level {depth + 1}): {filename}")
+            inner = build_mime_message(embedded, stats, fast_bodies, optimize_images,
+                                       max_embed_depth, max_embed_bytes, depth + 1)
+            part = MIMEMessage(inner)
+            part.add_header('Content-Disposition', 'attachment', filename=filename)
+            stats['embedded_messages'] += 1
+            mime_msg.attach(part)
+        elif hasattr(attachment, 'data') and attachment.data:
+            filename = attachment.longFilename or attachment.shortFilename or "attachment"
+            
+            data = attachment.data
+            mime_type = guess_mime_type(filename, data)
+            
+            # Check if this is an embedded image (has Content-ID)
+            content_id = getattr(attachment, 'contentId', None)
+            maintype, subtype = mime_type.split('/', 1)
+            if optimize_images and content_id and mime_type == 'image/png':
+                # Only inline images; attached files are kept byte for byte
+                repacked = repack_png(data)
+                stats['image_bytes_saved'] += len(data) - len(repacked)
+                data = repacked
+            part = MIMEBase(maintype, subtype)
+            part.set_payload(data)
+            encoders.encode_base64(part)
+            if depth:
+                stats['embedded_bytes'] += len(part.get_payload())
+            
+            if content_id and maintype == 'image':
+                # Handle as inline image, with Content-ID for cid: references
+                part.add_header('Content-ID', f'<{content_id}>')
+                part.add_header('Content-Disposition', 'inline', filename=filename)
+                print(f"  Added inline image: {filename} (Content-ID: {content_id})")
+                stats['inline_images'] += 1
+            else:
+                # Handle as regular attachment
+                part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+                print(f"  Added attachment: {filename} ({mime_type})")
+                stats['attachments'] += 1
+            
+            mime_msg.attach(part)
+        else:
+            stats['skipped_attachments'] += 1
+
+    return mime_msg
+
+
+def convert_oft_to_eml(oft_file_path, eml_file_path=None, validate=False, stats=None,
+                       fast_bodies=False, optimize_images=False,
+                       max_embed_depth=DEFAULT_MAX_EMBED_DEPTH,
+                       max_embed_bytes=DEFAULT_MAX_EMBED_BYTES):
     """
     Convert an OFT file to EML format.
     
     Args:
         oft_file_path (str): Path to the input OFT file
         eml_file_path (str): Path to the output EML file (optional)
+        validate (bool): Run prescan_oft() first and fail fast on bad input
+        stats (dict): If given, filled with counts of what was converted
+            (``attachments``, ``inline_images``, ``skipped_attachments``,
+            ``embedded_messages``, ``skipped_embedded``, ``embedded_bytes``,
+            ``body_bytes_saved``, ``image_bytes_saved``)
+        fast_bodies (bool): Keep bodies as bytes when their charset is known
+            and use 7bit or quoted-printable when smaller than base64
+        optimize_images (bool): Losslessly re-pack inline PNG images
+        max_embed_depth (int): Deepest level of embedded messages to convert
+        max_embed_bytes (int): Total encoded body and attachment bytes
+            allowed in embedded messages; attachments and embedded messages
+            past the limit are skipped without being read
         
     Returns:
         str: Path to the created EML file
+
+    Raises:
+        FileNotFoundError: If the input file does not exist
+        OFTValidationError: If ``validate`` is set and the pre-scan fails
     """
     
     # Validate input file
     if not os.path.exists(oft_file_path):
         raise FileNotFoundError(f"Input file not found: {oft_file_path}")
+
+    if validate:
+        scan = prescan_oft(oft_file_path)
+        if not scan.ok:
+            raise OFTValidationError(scan.error_message, scan.error_category)
     
     # Generate output filename if not provided
     if eml_file_path is None:
         base_name = Path(oft_file_path).stem
         eml_file_path = f"{base_name}.eml"
     
+    if stats is None:
+        stats = {}
+    stats.update(attachments=0, inline_images=0, skipped_attachments=0, embedded_messages=0,
+                 skipped_embedded=0, embedded_bytes=0, body_bytes_saved=0, image_bytes_saved=0)
+    
     try:
-        # Extract message from OFT file using extract_msg
+        # Extract message from OFT file using extract_msg. Attachments are
+        # loaded on demand so embedded messages past the depth limit are
+        # never parsed.
         print(f"Reading OFT file: {oft_file_path}")
-        msg = extract_msg.Message(oft_file_path)
-        
-        # Create MIME message - use 'related' to support inline images
-        mime_msg = MIMEMultipart('related')
-        
-        # Set headers
-        if msg.sender:
-            mime_msg['From'] = msg.sender
-        if msg.to:
-            mime_msg['To'] = msg.to
-        if msg.cc:
-            mime_msg['Cc'] = msg.cc
-        if msg.subject:
-            mime_msg['Subject'] = msg.subject
-        if msg.date:
-            mime_msg['Date'] = msg.date.strftime('%a, %d %b %Y %H:%M:%S %z') if hasattr(msg.date, 'strftime') else str(msg.date)
-        
-        # Create alternative container for text/html content
-        msg_alternative = MIMEMultipart('alternative')
-        
-        # Add message body
-        if msg.body:
-            text_part = MIMEText(msg.body, 'plain', 'utf-8')
-            msg_alternative.attach(text_part)
-        
-        if msg.htmlBody:
-            html_part = MIMEText(msg.htmlBody, 'html', 'utf-8')
-            msg_alternative.attach(html_part)
-        
-        # Add the alternative part to the main message
-        mime_msg.attach(msg_alternative)
+        msg = extract_msg.Message(oft_file_path, delayAttachments=True)
         
-        # Add attachments if any
-        if msg.attachments:
-            print(f"Found {len(msg.attachments)} attachments")
-            for attachment in msg.attachments:
-                if hasattr(attachment, 'data') and attachment.data:
-                    filename = attachment.longFilename or attachment.shortFilename or "attachment"
-                    
-                    # Check if this is an embedded image (has Content-ID)
-                    content_id = getattr(attachment, 'contentId', None)
-                    
-                    if content_id and filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                        # Handle as inline image
-                        image_type = filename.split('.')[-1].lower()
-                        if image_type == 'jpg':
-                            image_type = 'jpeg'
-                        
-                        part = MIMEBase('image', image_type)
-                        part.set_payload(attachment.data)
-                        encoders.encode_base64(part)
-                        
-                        # Set Content-ID for inline images
-                        part.add_header('Content-ID', f'<{content_id}>')
-                        part.add_header('Content-Disposition', 'inline', filename=filename)
-                        print(f"  Added inline image: {filename} (Content-ID: {content_id})")
-                    else:
-                        # Handle as regular attachment
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(attachment.data)
-                        encoders.encode_base64(part)
-                        part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                        print(f"  Added attachment: {filename}")
-                    
-                    mime_msg.attach(part)
+        mime_msg = build_mime_message(msg, stats, fast_bodies, optimize_images,
+                                      max_embed_depth, max_embed_bytes)
         
         # Write EML file
         print(f"Writing EML file: {eml_file_path}")
-        with open(eml_file_path, 'w', encoding='utf-8') as f:
-            f.write(mime_msg.as_string())
+        write_file_atomic(eml_file_path, mime_msg.as_string())
         
         print(f"Conversion completed successfully!")
         print(f"Output: {eml_file_path}")
@@ -134,11 +811,14 @@ def convert_oft_to_eml(oft_file_path, eml_file_path=None):
         print(f"Body length: {len(msg.body) if msg.body else 0} chars")
         print(f"HTML body length: {len(msg.htmlBody) if msg.htmlBody else 0} chars")
         print(f"Attachments: {len(msg.attachments) if msg.attachments else 0}")
+        if stats['embedded_messages'] or stats['skipped_embedded']:
+            print(f"Embedded messages: {stats['embedded_messages']} converted, "
+                  f"{stats['skipped_embedded']} skipped")
         
         return eml_file_path
         
     except Exception as e:
-        print(f"Error during conversion: {str(e)}")
+        print(f"Error during conversion ({classify_error(e)}): {str(e)}")
         raise
 
 
@@ -154,7 +834,7 @@ def main():
     eml_file = sys.argv[2] if len(sys.argv) > 2 else None
     
     try:
-        result_file = convert_oft_to_eml(oft_file, eml_file)
+        result_file = convert_oft_to_eml(oft_file, eml_file, validate=True)
         print(f"\nSuccess! EML file created: {result_file}")
     except Exception as e:
         print(f"Error: {str(e)}")
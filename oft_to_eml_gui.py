@@ -19,7 +19,6 @@ import sys
 import os
 import json
 import threading
-from pathlib import Path
 
 try:
     import tkinter as tk
@@ -29,7 +28,7 @@ except ImportError as e:
     print("Please install tkinter (usually comes with Python)")
     sys.exit(1)
 
-from oft_to_eml_converter import convert_oft_to_eml
+from oft_to_eml_batch import plan_batch, convert_file, rejected_result, output_path_for
 
 
 class OFTtoEMLGUI:
@@ -262,28 +261,38 @@ class OFTtoEMLGUI:
         self.progress_bar.config(maximum=total_files)
         successful_conversions = 0
         
-        for i, oft_file in enumerate(self.files_to_convert):
-            try:
-                # Update progress
-                self.progress_label.config(text=f"Converting file {i+1} of {total_files}...")
-                self.progress_bar.config(value=i)
-                self.root.update()
-                
-                # Generate output path
-                base_name = Path(oft_file).stem
-                output_path = os.path.join(self.output_dir.get(), f"{base_name}.eml")
-                
-                # Convert file
-                convert_oft_to_eml(oft_file, output_path)
-                
-                # Update results
-                file_name = os.path.basename(oft_file)
-                self.update_results(f"{file_name} → {os.path.basename(output_path)}")
+        self.conversion_results = []
+        
+        # Pre-scan so broken files are reported before any conversion starts
+        self.progress_label.config(text="Checking files...")
+        self.root.update()
+        plan = plan_batch(self.files_to_convert)
+        for scan in plan.rejected:
+            result = rejected_result(scan)
+            self.conversion_results.append(result)
+            file_name = os.path.basename(scan.path)
+            self.update_results(f"{file_name} - Rejected ({result.error_category}): {result.error_message}",
+                                success=False)
+        
+        for i, scan in enumerate(plan.accepted, start=len(plan.rejected)):
+            # Update progress
+            self.progress_label.config(text=f"Converting file {i+1} of {total_files}...")
+            self.progress_bar.config(value=i)
+            self.root.update()
+            
+            # Convert file
+            output_path = output_path_for(scan.path, self.output_dir.get(), plan.output_names)
+            result = convert_file(scan, self.output_dir.get(), output_path=output_path)
+            self.conversion_results.append(result)
+            
+            # Update results
+            file_name = os.path.basename(scan.path)
+            if result.ok:
+                self.update_results(f"{file_name} → {os.path.basename(result.output_path)}")
                 successful_conversions += 1
-                
-            except Exception as e:
-                file_name = os.path.basename(oft_file)
-                self.update_results(f"{file_name} - Error: {str(e)}", success=False)
+            else:
+                self.update_results(f"{file_name} - Error ({result.error_category}): {result.error_message}",
+                                    success=False)
         
         # Final progress update
         self.progress_bar.config(value=total_files)
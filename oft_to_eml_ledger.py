@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Shared work ledger for distributed batch conversion.
+
+Several converter processes, on one host or on several hosts sharing a
+filesystem, point at the same SQLite ledger. Each process adds its inputs
+(adding is idempotent), then repeatedly claims one file under a time-limited
+lease, converts it and records the result. A lease that runs out before the
+result is recorded, for example because the worker crashed, makes the file
+claimable again. A file whose lease has run out ``max_attempts`` times is
+marked failed so a file that crashes the converter cannot block the batch.
+
+Notes:
+- Lease expiry uses wall-clock time, so hosts need synchronized clocks.
+- The ledger uses SQLite's default rollback journal rather than WAL, because
+  WAL does not work on network filesystems.
+- While a worker converts a file it renews the lease every third of the
+  lease time, so only workers that died (or lost the ledger) lose their
+  files, however long a conversion takes.
+- Output names are assigned when inputs are added, so inputs with the same
+  name from different directories or hosts get separate EML files.
+- Workers convert into a staged file and only move it into place while they
+  still hold the lease, so a worker that lost its lease never touches the
+  output of the worker that took over.
+
+Usage (start the same command once per worker, on any host):
+    python oft_to_eml_ledger.py <ledger.db> -o <output_dir> [<input_file_or_dir>...]
+"""
+
+import sys
+import os
+import argparse
+import json
+import re
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+from oft_to_eml_converter import (
+    prescan_oft, classify_error, ERROR_NOT_FOUND, DEFAULT_MAX_EMBED_DEPTH,
+)
+from oft_to_eml_batch import (
+    collect_inputs, convert_file, rejected_result, quarantine_file, summarize_results,
+    write_record, unique_output_names, STATUS_CONVERTED, STATUS_REJECTED, STATUS_FAILED,
+)
+
+STATUS_PENDING = 'pending'
+STATUS_CLAIMED = 'claimed'
+
+ERROR_LEASE_EXPIRED = 'lease_expired'
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_SECONDS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work (
+    input_path TEXT PRIMARY KEY,
+    output_name TEXT NOT NULL UNIQUE,
+    input_bytes INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS work_status ON work (status, input_bytes);
+"""
+
+
+def default_worker_id():
+    """Return an ID that is unique per process across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkLedger:
+    """SQLite-backed queue of input files shared by many workers."""
+
+    def __init__(self, db_path, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # Autocommit mode; write transactions are opened explicitly with
+        # BEGIN IMMEDIATE so concurrent claims serialize on the DB lock
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def add_inputs(self, oft_files):
+        """
+        Add input files to the ledger; files already present are left alone.
+
+        Each new file is given an EML name that no other file in the ledger
+        uses (see unique_output_names()).
+
+        Args:
+            oft_files (list): Paths to the input OFT files
+
+        Returns:
+            int: Number of newly added files
+        """
+        paths = list(dict.fromkeys(os.path.abspath(oft_file) for oft_file in oft_files))
+        sizes = {path: os.path.getsize(path) if os.path.exists(path) else 0 for path in paths}
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            known = dict(conn.execute("SELECT input_path, output_name FROM work"))
+            new_paths = [path for path in paths if path not in known]
+            names = unique_output_names(new_paths, taken=known.values())
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO work (input_path, output_name, input_bytes, updated) "
+                "VALUES (?, ?, ?, ?)",
+                [(path, names[path], sizes[path], now) for path in new_paths])
+            conn.execute("COMMIT")
+        return len(new_paths)
+
+    def claim(self):
+        """
+        Claim the largest file that is pending or whose lease has run out.
+
+        Returns:
+            str: Path of the claimed file, or None when nothing is claimable
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Give up on files whose workers keep dying on them
+            conn.execute(
+                "UPDATE work SET status = ?, worker = NULL, lease_expires = NULL, result = ?, "
+                "updated = ? WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (STATUS_FAILED, json.dumps({'error_category': ERROR_LEASE_EXPIRED}), now,
+                 STATUS_CLAIMED, now, self.max_attempts))
+            row = conn.execute(
+                "SELECT input_path FROM work WHERE status = ? "
+                "OR (status = ? AND lease_expires < ?) "
+                "ORDER BY input_bytes DESC, input_path LIMIT 1",
+                (STATUS_PENDING, STATUS_CLAIMED, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE work SET status = ?, worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE input_path = ?",
+                (STATUS_CLAIMED, self.worker_id, now + self.lease_seconds, now, row[0]))
+            conn.execute("COMMIT")
+        return row[0]
+
+    def renew(self, input_path):
+        """
+        Extend this worker's lease on a claimed file.
+
+        Args:
+            input_path (str): Path returned by claim()
+
+        Returns:
+            bool: False if the lease is no longer held by this worker
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE work SET lease_expires = ?, updated = ? "
+                "WHERE input_path = ? AND status = ? AND worker = ?",
+                (now + self.lease_seconds, now, input_path, STATUS_CLAIMED, self.worker_id))
+        return cursor.rowcount == 1
+
+    def output_name(self, input_path):
+        """Return the EML file name assigned to an input."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT output_name FROM work WHERE input_path = ?",
+                               (input_path,)).fetchone()
+        return row[0] if row else None
+
+    def complete(self, input_path, result, staged_path=None):
+        """
+        Record the result for a claimed file.
+
+        The result is only recorded while this worker still holds the lease;
+        if the lease ran out and another worker claimed the file, that worker
+        records the result instead.
+
+        Args:
+            input_path (str): Path returned by claim()
+            result (FileResult): Outcome of the conversion
+            staged_path (str): Converted file to move to ``result.output_path``
+                (optional). It is moved while the ledger is locked and only if
+                the lease is still held; otherwise it is deleted.
+
+        Returns:
+            bool: True if the result was recorded
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            owned = conn.execute(
+                "SELECT 1 FROM work WHERE input_path = ? AND status = ? AND worker = ?",
+                (input_path, STATUS_CLAIMED, self.worker_id)).fetchone() is not None
+            if owned:
+                if staged_path:
+                    try:
+                        os.replace(staged_path, result.output_path)
+                    except OSError as e:
+                        result.status = STATUS_FAILED
+                        result.output_path = None
+                        result.error_category = classify_error(e)
+                        result.error_message = str(e)
+                conn.execute(
+                    "UPDATE work SET status = ?, lease_expires = NULL, result = ?, updated = ? "
+                    "WHERE input_path = ?",
+                    (result.status, json.dumps(result.to_record()), time.time(), input_path))
+            conn.execute("COMMIT")
+        if staged_path and os.path.exists(staged_path):
+            os.remove(staged_path)
+        return owned
+
+    def counts(self):
+        """Return the number of files in each status."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM work GROUP BY status").fetchall()
+        counts = {status: 0 for status in (STATUS_PENDING, STATUS_CLAIMED, STATUS_CONVERTED,
+                                           STATUS_REJECTED, STATUS_FAILED)}
+        counts.update(rows)
+        return counts
+
+
+def staged_path_for(output_path, worker_id):
+    """Return the worker's private file name for an output it is converting."""
+    directory, name = os.path.split(output_path)
+    token = re.sub(r'[^A-Za-z0-9_.-]', '_', worker_id)
+    return os.path.join(directory, f".{name}.{token}.part")
+
+
+@contextmanager
+def lease_heartbeat(ledger, input_path):
+    """
+    Renew the lease on ``input_path`` in a background thread while the
+    ``with`` block runs.
+
+    Renewal stops once the lease turns out to be lost. A zero or negative
+    lease (never valid for long) is not renewed.
+
+    Args:
+        ledger (WorkLedger): The shared ledger
+        input_path (str): Path returned by claim()
+    """
+    if ledger.lease_seconds <= 0:
+        yield
+        return
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(ledger.lease_seconds / 3):
+            try:
+                if not ledger.renew(input_path):
+                    return
+            except sqlite3.Error as e:
+                # Try again next beat; the lease is still valid for a while
+                print(f"Could not renew lease on {input_path}: {e}")
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_worker(ledger, output_dir, quarantine_dir=None, report=None, wait=False,
+               poll_seconds=DEFAULT_POLL_SECONDS, options=None):
+    """
+    Claim and convert files from the ledger until none are left.
+
+    Args:
+        ledger (WorkLedger): The shared ledger
+        output_dir (str): Directory for the EML files
+        quarantine_dir (str): Where to move rejected inputs (optional)
+        report (file): Text stream for JSON lines file records (optional)
+        wait (bool): Keep polling while other workers hold leases, so files
+            of workers that crash are still picked up
+        poll_seconds (float): Delay between polls when waiting
+        options (dict): Extra keyword arguments for convert_oft_to_eml()
+
+    Returns:
+        list: FileResult for every file this worker recorded
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    while True:
+        oft_file = ledger.claim()
+        if oft_file is None:
+            if wait and ledger.counts()[STATUS_CLAIMED]:
+                time.sleep(poll_seconds)
+                continue
+            break
+
+        with lease_heartbeat(ledger, oft_file):
+            scan = prescan_oft(oft_file)
+            staged_path = None
+            if scan.ok:
+                output_path = os.path.join(output_dir, ledger.output_name(oft_file))
+                staged_path = staged_path_for(output_path, ledger.worker_id)
+                result = convert_file(scan, output_dir, options, staged_path)
+                if result.ok:
+                    result.output_path = output_path
+                else:
+                    staged_path = None
+            else:
+                print(f"Rejected {scan.path} ({scan.error_category}): {scan.error_message}")
+                if quarantine_dir and scan.error_category != ERROR_NOT_FOUND:
+                    quarantine_file(scan.path, quarantine_dir)
+                result = rejected_result(scan)
+
+        if ledger.complete(oft_file, result, staged_path):
+            results.append(result)
+            if report is not None:
+                write_record(report, result.to_record())
+        else:
+            print(f"Lease on {oft_file} was lost; result left to the new owner")
+    return results
+
+
+def main():
+    """Main entry point for a ledger worker."""
+    parser = argparse.ArgumentParser(
+        description="Convert OFT files to EML, sharing the work with other processes.")
+    parser.add_argument('ledger', help="Path to the shared SQLite ledger")
+    parser.add_argument('inputs', nargs='*',
+                        help="OFT files or directories to add to the ledger")
+    parser.add_argument('-o', '--output-dir', default='.', help="Directory for the EML files")
+    parser.add_argument('--quarantine', metavar='DIR',
+                        help="Move inputs that fail the pre-scan into DIR")
+    parser.add_argument('--report', metavar='FILE',
+                        help="Append JSON lines results for this worker to FILE")
+    parser.add_argument('--worker-id', help="Worker name (default: host:pid)")
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS,
+                        help="Seconds before a claimed file can be taken over")
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="Claims allowed per file before it is marked failed")
+    parser.add_argument('--wait', action='store_true',
+                        help="Keep running until files claimed by other workers are done")
+    parser.add_argument('--fast-bodies', action='store_true',
+                        help="Pass bodies through as bytes and pick the smallest transfer encoding")
+    parser.add_argument('--optimize-images', action='store_true',
+                        help="Losslessly re-pack inline PNG images")
+    parser.add_argument('--max-embed-depth', type=int, default=DEFAULT_MAX_EMBED_DEPTH,
+                        help="Deepest level of embedded messages to convert")
+    args = parser.parse_args()
+
+    ledger = WorkLedger(args.ledger, args.worker_id, args.lease, args.max_attempts)
+    added = ledger.add_inputs(collect_inputs(args.inputs))
+    print(f"Worker {ledger.worker_id}: added {added} new files to {args.ledger}")
+
+    options = {'fast_bodies': args.fast_bodies, 'optimize_images': args.optimize_images,
+               'max_embed_depth': args.max_embed_depth}
+    start = time.perf_counter()
+    if args.report:
+        with open(args.report, 'a', encoding='utf-8') as report:
+            results = run_worker(ledger, args.output_dir, args.quarantine, report,
+                                 wait=args.wait, options=options)
+    else:
+        results = run_worker(ledger, args.output_dir, args.quarantine, wait=args.wait,
+                             options=options)
+    summary = summarize_results(results, time.perf_counter() - start)
+
+    counts = ledger.counts()
+    print(f"\nWorker {ledger.worker_id}: {summary['converted']}/{summary['total']} "
+          f"files converted by this worker")
+    print("Ledger: " + ", ".join(f"{status} {count}" for status, count in counts.items()))
+    sys.exit(1 if summary['converted'] != summary['total'] else 0)
+
+
+if __name__ == "__main__":
+    main()
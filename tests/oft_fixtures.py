@@ -0,0 +1,89 @@
+"""
+Helpers for building small but real OFT files in tests.
+
+The files are written with extract_msg's OLE writer, so they go through the
+same parsing path as templates saved by Outlook.
+"""
+
+import struct
+
+from extract_msg.ole_writer import OleWriter
+
+OFT_CLSID_BYTES = bytes.fromhex('46f0060000000000c000000000000046')
+
+# PR_ATTACH_METHOD values
+ATTACH_BY_VALUE = 1
+ATTACH_EMBEDDED_MSG = 5
+
+
+def _add_message(writer, prefix, subject, body, attachments, embedded, html, internet_cpid,
+                 header_size):
+    """Add the streams of one message below ``prefix``."""
+    properties = b'\x00' * header_size
+    if internet_cpid is not None:
+        # PR_INTERNET_CPID
+        properties += struct.pack('<IIQ', 0x3FDE0003, 6, internet_cpid)
+    writer.addEntry(prefix + ['__properties_version1.0'], properties)
+    writer.addEntry(prefix + ['__substg1.0_001A001F'], 'IPM.Note'.encode('utf-16-le'))
+    writer.addEntry(prefix + ['__substg1.0_0037001F'], subject.encode('utf-16-le'))
+    writer.addEntry(prefix + ['__substg1.0_1000001F'], body.encode('utf-16-le'))
+    if html is not None:
+        writer.addEntry(prefix + ['__substg1.0_10130102'], html)
+
+    for index, attachment in enumerate(attachments):
+        filename, data = attachment[:2]
+        storage = prefix + [f'__attach_version1.0_#{index:08X}']
+        properties = b'\x00' * 8 + struct.pack('<IIQ', 0x37050003, 6, ATTACH_BY_VALUE)
+        writer.addEntry(storage + ['__properties_version1.0'], properties)
+        writer.addEntry(storage + ['__substg1.0_3707001F'], filename.encode('utf-16-le'))
+        if len(attachment) > 2:
+            writer.addEntry(storage + ['__substg1.0_3712001F'], attachment[2].encode('utf-16-le'))
+        writer.addEntry(storage + ['__substg1.0_37010102'], data)
+
+    for index, message in enumerate(embedded, start=len(attachments)):
+        storage = prefix + [f'__attach_version1.0_#{index:08X}']
+        properties = b'\x00' * 8 + struct.pack('<IIQ', 0x37050003, 6, ATTACH_EMBEDDED_MSG)
+        writer.addEntry(storage + ['__properties_version1.0'], properties)
+        _add_message(writer, storage + ['__substg1.0_3701000D'],
+                     message.get('subject', 'Embedded'), message.get('body', 'Embedded body'),
+                     message.get('attachments', ()), message.get('embedded', ()), None, None,
+                     header_size=24)
+
+
+def write_test_oft(path, subject="Test Subject", body="Test body", attachments=(),
+                   clsid=OFT_CLSID_BYTES, html=None, internet_cpid=None, embedded=()):
+    """
+    Write a minimal OFT file.
+
+    Args:
+        path (str): Where to write the file
+        subject (str): Message subject
+        body (str): Plain text body
+        attachments (iterable): ``(filename, data)`` or
+            ``(filename, data, content_id)`` tuples
+        clsid (bytes): Root storage CLSID
+        html (bytes): Raw HTML body stream (optional)
+        internet_cpid (int): Code page of the HTML body (optional)
+        embedded (iterable): Embedded messages as dicts with optional
+            ``subject``, ``body``, ``attachments`` and ``embedded`` keys
+
+    Returns:
+        str: ``path``
+    """
+    writer = OleWriter(rootClsid=clsid)
+    # Empty named property streams (required once attachments are present)
+    for stream in ('00020102', '00030102', '00040102'):
+        writer.addEntry(['__nameid_version1.0', f'__substg1.0_{stream}'], b'')
+    _add_message(writer, [], subject, body, attachments, embedded, html, internet_cpid,
+                 header_size=32)
+    writer.write(path)
+    return path
+
+
+def nested_messages(depth, subject="Level"):
+    """Return ``embedded`` for a chain of ``depth`` nested messages."""
+    embedded = ()
+    for level in range(depth, 0, -1):
+        embedded = ({'subject': f"{subject} {level}", 'body': f"Body {level}",
+                     'embedded': embedded},)
+    return embedded
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Test suite for the OFT to EML batch converter.
+
+This module tests:
+- Pre-scan triage and work ordering
+- Quarantine of rejected inputs
+- End-to-end batch conversion
+- JSON lines reports and retries
+"""
+
+import unittest
+import os
+import io
+import json
+import tempfile
+import shutil
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from oft_to_eml_batch import (
+    collect_inputs, plan_batch, convert_batch, load_failed_inputs,
+    STATUS_CONVERTED, STATUS_REJECTED, LINK_HARDLINK, LINK_REFLINK, LINK_MANIFEST, LINK_COPY,
+    DEDUPE_MANIFEST,
+)
+from oft_to_eml_converter import convert_oft_to_eml, ERROR_NOT_OLE, ERROR_EMPTY
+from tests.oft_fixtures import write_test_oft
+
+
+class TestBatchConverter(unittest.TestCase):
+    """Test cases for the batch converter."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.test_dir, "in")
+        self.output_dir = os.path.join(self.test_dir, "out")
+        os.makedirs(self.input_dir)
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def write_bad(self, name, data):
+        """Write a file that fails the pre-scan."""
+        path = os.path.join(self.input_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_plan_orders_by_work(self):
+        """Test that accepted files are ordered largest first."""
+        small = write_test_oft(os.path.join(self.input_dir, "small.oft"), body="x")
+        large = write_test_oft(os.path.join(self.input_dir, "large.oft"),
+                               attachments=[("big.bin", b"z" * 5000)])
+        bad = self.write_bad("bad.oft", b"garbage")
+
+        plan = plan_batch(collect_inputs([self.input_dir]))
+
+        self.assertEqual([scan.path for scan in plan.accepted], [large, small])
+        self.assertEqual([scan.path for scan in plan.rejected], [bad])
+        self.assertEqual(plan.total_input_bytes,
+                         os.path.getsize(small) + os.path.getsize(large))
+        self.assertGreaterEqual(plan.total_work, 5000)
+
+    def test_convert_batch_with_quarantine(self):
+        """Test conversion of good files and quarantine of bad ones."""
+        good = write_test_oft(os.path.join(self.input_dir, "good.oft"), subject="Hello")
+        bad = self.write_bad("bad.oft", b"garbage")
+        empty = self.write_bad("empty.oft", b"")
+        quarantine_dir = os.path.join(self.test_dir, "quarantine")
+
+        with redirect_stdout(io.StringIO()):
+            results, summary = convert_batch([good, bad, empty], self.output_dir, quarantine_dir)
+
+        by_input = {r.input_path: r for r in results}
+        self.assertEqual(by_input[good].output_path, os.path.join(self.output_dir, "good.eml"))
+        self.assertEqual(by_input[good].status, STATUS_CONVERTED)
+        self.assertEqual(by_input[bad].error_category, ERROR_NOT_OLE)
+        self.assertEqual(by_input[empty].error_category, ERROR_EMPTY)
+        self.assertEqual(summary['converted'], 1)
+        self.assertEqual(summary['rejected'], 2)
+
+        with open(os.path.join(self.output_dir, "good.eml"), encoding='utf-8') as f:
+            self.assertIn("Subject: Hello", f.read())
+        self.assertTrue(os.path.exists(os.path.join(quarantine_dir, "bad.oft")))
+        self.assertTrue(os.path.exists(os.path.join(quarantine_dir, "empty.oft")))
+        self.assertFalse(os.path.exists(bad))
+
+    def test_json_lines_report(self):
+        """Test the streamed per-file records and the final summary."""
+        good = write_test_oft(os.path.join(self.input_dir, "good.oft"),
+                              attachments=[("a.bin", b"data"), ("logo.png", b"png", "logo@x")])
+        bad = self.write_bad("bad.oft", b"garbage")
+        report = io.StringIO()
+
+        with redirect_stdout(io.StringIO()):
+            convert_batch([good, bad], self.output_dir, report=report)
+
+        records = [json.loads(line) for line in report.getvalue().splitlines()]
+        self.assertEqual([r['type'] for r in records], ['file', 'file', 'summary'])
+        by_input = {r['input_path']: r for r in records[:2]}
+
+        self.assertEqual(by_input[bad]['status'], STATUS_REJECTED)
+        self.assertEqual(by_input[bad]['error_category'], ERROR_NOT_OLE)
+        converted = by_input[good]
+        self.assertEqual(converted['status'], STATUS_CONVERTED)
+        self.assertEqual(converted['input_bytes'], os.path.getsize(good))
+        self.assertEqual(converted['output_bytes'], os.path.getsize(converted['output_path']))
+        self.assertEqual(converted['attachments'], 1)
+        self.assertEqual(converted['inline_images'], 1)
+        self.assertGreaterEqual(converted['elapsed_seconds'], 0)
+
+        summary = records[-1]
+        self.assertEqual(summary['total'], 2)
+        self.assertEqual(summary['errors'], {ERROR_NOT_OLE: 1})
+        self.assertEqual(summary['output_bytes'], converted['output_bytes'])
+
+        # Only the rejected file is picked up for a retry
+        report_path = os.path.join(self.test_dir, "report.jsonl")
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        self.assertEqual(load_failed_inputs(report_path), [bad])
+
+    def test_same_name_in_different_directories(self):
+        """Test that inputs sharing a name get separate EML files."""
+        first = write_test_oft(os.path.join(self.input_dir, "x.oft"), subject="First")
+        os.makedirs(os.path.join(self.input_dir, "b"))
+        second = write_test_oft(os.path.join(self.input_dir, "b", "X.oft"), subject="Second",
+                                attachments=[("big.bin", b"z" * 5000)])
+
+        with redirect_stdout(io.StringIO()):
+            results, summary = convert_batch([first, second], self.output_dir)
+
+        by_input = {r.input_path: r for r in results}
+        self.assertEqual(by_input[first].output_path, os.path.join(self.output_dir, "x.eml"))
+        self.assertEqual(by_input[second].output_path, os.path.join(self.output_dir, "X_1.eml"))
+        for path, subject in ((first, "First"), (second, "Second")):
+            with open(by_input[path].output_path, encoding='utf-8') as f:
+                self.assertIn(f"Subject: {subject}", f.read())
+        self.assertEqual(summary['converted'], 2)
+
+    def test_repeated_inputs(self):
+        """Test that a file named by both a directory and a file argument is handled once."""
+        good = write_test_oft(os.path.join(self.input_dir, "a.oft"), subject="A")
+        bad = self.write_bad("bad.oft", b"garbage")
+        inputs = collect_inputs([self.input_dir, good, os.path.join(self.input_dir, ".", "bad.oft")])
+        quarantine_dir = os.path.join(self.test_dir, "quarantine")
+
+        for dedupe in (None, LINK_HARDLINK):
+            with self.subTest(dedupe=dedupe):
+                output_dir = os.path.join(self.test_dir, f"out-{dedupe}")
+                with redirect_stdout(io.StringIO()):
+                    results, summary = convert_batch(inputs, output_dir, quarantine_dir,
+                                                     dedupe=dedupe)
+                self.assertEqual(sorted(r.input_path for r in results), sorted([good, bad]))
+                self.assertEqual(summary['converted'], 1)
+                self.assertEqual(os.listdir(output_dir), ["a.eml"])
+                self.assertEqual(os.listdir(quarantine_dir), ["bad.oft"])
+                # Put the rejected file back for the next run
+                shutil.move(os.path.join(quarantine_dir, "bad.oft"), bad)
+
+    def make_copies(self):
+        """Write one template, two identical copies of it and one other template."""
+        original = write_test_oft(os.path.join(self.input_dir, "a.oft"), subject="Same")
+        copies = []
+        for name in ("b.oft", "c.oft"):
+            copies.append(os.path.join(self.input_dir, name))
+            shutil.copyfile(original, copies[-1])
+        # Same size as the original but different content
+        other = write_test_oft(os.path.join(self.input_dir, "d.oft"), subject="Diff")
+        return original, copies, other
+
+    def test_dedupe_hardlink(self):
+        """Test that identical inputs are converted once and hard-linked."""
+        original, copies, other = self.make_copies()
+
+        with patch('oft_to_eml_batch.convert_oft_to_eml', wraps=convert_oft_to_eml) as convert:
+            with redirect_stdout(io.StringIO()):
+                results, summary = convert_batch([original] + copies + [other], self.output_dir,
+                                                 dedupe=LINK_HARDLINK)
+
+        self.assertEqual(sorted(call.args[0] for call in convert.call_args_list),
+                         [original, other])
+        by_input = {r.input_path: r for r in results}
+        original_eml = os.stat(by_input[original].output_path)
+        for copy in copies:
+            result = by_input[copy]
+            self.assertEqual(result.status, STATUS_CONVERTED)
+            self.assertEqual(result.duplicate_of, original)
+            self.assertEqual(result.link, LINK_HARDLINK)
+            self.assertTrue(os.path.samefile(result.output_path, by_input[original].output_path))
+        self.assertEqual(original_eml.st_nlink, 3)
+        self.assertIsNone(by_input[other].duplicate_of)
+        self.assertEqual(summary['duplicates'], 2)
+        self.assertEqual(summary['dedupe_saved_bytes'], 2 * original_eml.st_size)
+
+    def test_rerun_over_linked_outputs(self):
+        """Test that writing one hard-linked output leaves the others intact."""
+        original, copies, _ = self.make_copies()
+        with redirect_stdout(io.StringIO()):
+            convert_batch([original] + copies, self.output_dir, dedupe=LINK_HARDLINK)
+            # Linking again over the existing links is a no-op
+            results, _ = convert_batch([original] + copies, self.output_dir,
+                                       dedupe=LINK_HARDLINK)
+        self.assertEqual(os.stat(results[0].output_path).st_nlink, 3)
+
+        # A later run writes a different template to one of the linked names
+        os.makedirs(os.path.join(self.input_dir, "other"))
+        unrelated = write_test_oft(os.path.join(self.input_dir, "other", "b.oft"),
+                                   subject="Unrelated")
+        with redirect_stdout(io.StringIO()):
+            convert_batch([unrelated], self.output_dir)
+
+        for name, subject in (("a.eml", "Same"), ("b.eml", "Unrelated"), ("c.eml", "Same")):
+            with open(os.path.join(self.output_dir, name), encoding='utf-8') as f:
+                self.assertIn(f"Subject: {subject}", f.read())
+        self.assertEqual(os.stat(os.path.join(self.output_dir, "a.eml")).st_nlink, 2)
+        self.assertFalse([name for name in os.listdir(self.output_dir) if name.endswith('.tmp')])
+
+    def test_dedupe_reflink_and_manifest(self):
+        """Test the reflink mode (with copy fallback) and the manifest mode."""
+        original, copies, _ = self.make_copies()
+
+        with redirect_stdout(io.StringIO()):
+            results, _ = convert_batch([original] + copies, self.output_dir, dedupe=LINK_REFLINK)
+        for result in results[1:]:
+            self.assertIn(result.link, (LINK_REFLINK, LINK_COPY))
+            with open(result.output_path, 'rb') as f, open(results[0].output_path, 'rb') as g:
+                self.assertEqual(f.read(), g.read())
+
+        manifest_dir = os.path.join(self.test_dir, "manifest")
+        with redirect_stdout(io.StringIO()):
+            results, summary = convert_batch([original] + copies, manifest_dir,
+                                             dedupe=LINK_MANIFEST)
+        self.assertEqual(os.listdir(manifest_dir).count("a.eml"), 1)
+        self.assertEqual(summary['output_bytes'], os.path.getsize(results[0].output_path))
+        self.assertFalse(os.path.exists(os.path.join(manifest_dir, "b.eml")))
+        with open(os.path.join(manifest_dir, DEDUPE_MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest, {copy: os.path.join(manifest_dir, "a.eml") for copy in copies})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,7 +10,10 @@ This module tests the core conversion functionality including:
 """
 
 import unittest
+import io
 import os
+import struct
+import zlib
 import tempfile
 import shutil
 from pathlib import Path
@@ -20,7 +23,13 @@ from email.mime.multipart import MIMEMultipart
 from unittest.mock import Mock, patch, MagicMock
 
 # Import the converter module
-from oft_to_eml_converter import convert_oft_to_eml
+from oft_to_eml_converter import (
+    convert_oft_to_eml, prescan_oft, classify_error, OFTValidationError,
+    choose_transfer_encoding, base64_size, guess_mime_type, repack_png,
+    ERROR_EMPTY, ERROR_NOT_OLE, ERROR_TRUNCATED, ERROR_NOT_OUTLOOK, ERROR_NOT_FOUND, ERROR_IO,
+    ERROR_BAD_DIRECTORY,
+)
+from tests.oft_fixtures import write_test_oft, nested_messages
 
 
 class TestOFTtoEMLConverter(unittest.TestCase):
@@ -218,6 +227,366 @@ class TestOFTtoEMLConverter(unittest.TestCase):
             self.assertIsNotNone(msg)
 
 
+class TestPrescan(unittest.TestCase):
+    """Test cases for the OFT pre-scan."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.test_oft = os.path.join(self.test_dir, "test.oft")
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_valid_template(self):
+        """Test that a well-formed template passes with size estimates."""
+        write_test_oft(self.test_oft, body="Hello",
+                       attachments=[("a.bin", b"x" * 100), ("b.bin", b"y" * 50)])
+        
+        result = prescan_oft(self.test_oft)
+        
+        self.assertTrue(result.ok)
+        self.assertEqual(result.kind, "template")
+        self.assertEqual(result.attachment_count, 2)
+        self.assertEqual(result.body_bytes, len("Hello".encode('utf-16-le')))
+        self.assertEqual(result.attachment_bytes, 150)
+        self.assertEqual(result.estimated_work, 160)
+    
+    def test_rejections(self):
+        """Test the error category of each kind of bad input."""
+        write_test_oft(self.test_oft)
+        with open(self.test_oft, 'rb') as f:
+            valid = f.read()
+        
+        cases = {
+            ERROR_EMPTY: b"",
+            ERROR_NOT_OLE: b"not an oft file",
+            ERROR_TRUNCATED: valid[:1024],
+        }
+        for category, data in cases.items():
+            path = os.path.join(self.test_dir, f"{category}.oft")
+            with open(path, 'wb') as f:
+                f.write(data)
+            with self.subTest(category=category):
+                result = prescan_oft(path)
+                self.assertFalse(result.ok)
+                self.assertEqual(result.error_category, category)
+        
+        # A multi-sector file missing its last sector
+        write_test_oft(self.test_oft, attachments=[("big.bin", bytes(range(256)) * 80)])
+        with open(self.test_oft, 'rb') as f:
+            data = f.read()
+        self.assertTrue(prescan_oft(self.test_oft).ok)
+        for cut in (512, len(data) // 4 // 512 * 512):
+            with open(self.test_oft, 'wb') as f:
+                f.write(data[:-cut])
+            with self.subTest(cut=cut):
+                self.assertEqual(prescan_oft(self.test_oft).error_category, ERROR_TRUNCATED)
+        
+        # A valid OLE file that is not an Outlook item (foreign root CLSID)
+        other = write_test_oft(os.path.join(self.test_dir, "other.oft"), clsid=bytes(range(16)))
+        self.assertEqual(prescan_oft(other).error_category, ERROR_NOT_OUTLOOK)
+        self.assertEqual(prescan_oft(os.path.join(self.test_dir, "missing.oft")).error_category,
+                         ERROR_NOT_FOUND)
+        
+        # An unreadable file is rejected, not raised
+        with patch('builtins.open', side_effect=PermissionError(13, "Permission denied")):
+            result = prescan_oft(self.test_oft)
+        self.assertEqual(result.error_category, ERROR_IO)
+        self.assertIn("Permission denied", result.error_message)
+    
+    def test_convert_with_validation(self):
+        """Test that validate=True fails before the file is parsed."""
+        with open(self.test_oft, 'wb') as f:
+            f.write(b"not an oft file")
+        
+        with patch('oft_to_eml_converter.extract_msg.Message') as mock_message_class:
+            with self.assertRaises(OFTValidationError) as ctx:
+                convert_oft_to_eml(self.test_oft, os.path.join(self.test_dir, "out.eml"),
+                                   validate=True)
+            mock_message_class.assert_not_called()
+        self.assertEqual(ctx.exception.category, ERROR_NOT_OLE)
+        self.assertEqual(classify_error(ctx.exception), ERROR_NOT_OLE)
+    
+    def test_classify_corrupt_ole(self):
+        """Test that olefile errors count as corrupt input, not as I/O errors."""
+        write_test_oft(self.test_oft)
+        with open(self.test_oft, 'r+b') as f:
+            # Break the FAT, which starts right after the 512 byte header
+            f.seek(519)
+            f.write(b'\xff')
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            with self.assertRaises(OSError) as ctx:
+                convert_oft_to_eml(self.test_oft, os.path.join(self.test_dir, "out.eml"))
+        self.assertEqual(classify_error(ctx.exception), ERROR_BAD_DIRECTORY)
+        self.assertEqual(classify_error(PermissionError(13, "Permission denied")), ERROR_IO)
+
+
+class TestFastBodies(unittest.TestCase):
+    """Test cases for the byte-preserving body path."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.test_oft = os.path.join(self.test_dir, "test.oft")
+        self.test_eml = os.path.join(self.test_dir, "test.eml")
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def convert(self, **kwargs):
+        """Convert the test file with fast bodies and return (message, stats)."""
+        write_test_oft(self.test_oft, **kwargs)
+        stats = {}
+        with patch('sys.stdout', new_callable=io.StringIO):
+            convert_oft_to_eml(self.test_oft, self.test_eml, stats=stats, fast_bodies=True)
+        with open(self.test_eml, 'r', encoding='utf-8') as f:
+            return message_from_string(f.read()), stats
+    
+    def body_parts(self, msg):
+        """Return the text parts keyed by subtype."""
+        return {part.get_content_subtype(): part for part in msg.walk()
+                if part.get_content_maintype() == 'text'}
+    
+    def test_choose_transfer_encoding(self):
+        """Test the encoding choice for typical bodies."""
+        self.assertEqual(choose_transfer_encoding(b"Hello\nWorld"), "7bit")
+        self.assertEqual(choose_transfer_encoding(b"x" * 1200), "quoted-printable")
+        self.assertEqual(choose_transfer_encoding("Vielen Dank für Ihre Nachricht. ".encode('utf-8') * 5),
+                         "quoted-printable")
+        self.assertEqual(choose_transfer_encoding("你好世界".encode('utf-8') * 20), "base64")
+        self.assertEqual(base64_size(3), 5)
+    
+    def test_ascii_bodies_use_7bit(self):
+        """Test that ASCII bodies are written without base64."""
+        msg, stats = self.convert(body="Plain body\r\nSecond line",
+                                  html=b"<html><body><p>Hi</p></body></html>")
+        
+        parts = self.body_parts(msg)
+        self.assertEqual(parts['plain']['Content-Transfer-Encoding'], '7bit')
+        self.assertEqual(parts['plain'].get_payload(decode=True), b"Plain body\nSecond line")
+        self.assertEqual(parts['html']['Content-Transfer-Encoding'], '7bit')
+        self.assertEqual(parts['html'].get_content_charset(), 'us-ascii')
+        self.assertGreater(stats['body_bytes_saved'], 0)
+    
+    def test_html_code_page_passthrough(self):
+        """Test that an HTML body in a known code page keeps its bytes."""
+        html = "<html><body><p>Café crème – 10 €</p></body></html>".encode('cp1252')
+        msg, _ = self.convert(html=html, internet_cpid=1252)
+        
+        part = self.body_parts(msg)['html']
+        self.assertEqual(part.get_content_charset(), 'windows-1252')
+        self.assertEqual(part['Content-Transfer-Encoding'], 'quoted-printable')
+        self.assertEqual(part.get_payload(decode=True), html)
+    
+    def test_html_meta_charset(self):
+        """Test that the charset falls back to the HTML meta tag."""
+        html = ('<html><head><meta charset="iso-8859-1"></head>'
+                '<body>Größe</body></html>').encode('latin-1')
+        msg, _ = self.convert(html=html)
+        
+        part = self.body_parts(msg)['html']
+        self.assertEqual(part.get_content_charset(), 'iso-8859-1')
+        self.assertEqual(part.get_payload(decode=True), html)
+
+
+def make_png(width=64, height=64, level=0, text=b""):
+    """Build a grayscale PNG with the given zlib level and optional tEXt chunk."""
+    def chunk(chunk_type, body):
+        return (struct.pack('>I', len(body)) + chunk_type + body +
+                struct.pack('>I', zlib.crc32(chunk_type + body) & 0xFFFFFFFF))
+    
+    rows = b"".join(b"\x00" + bytes((x * y) & 0xFF for x in range(width)) for y in range(height))
+    png = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+    if text:
+        png += chunk(b"tEXt", b"Comment\x00" + text)
+    return png + chunk(b"IDAT", zlib.compress(rows, level)) + chunk(b"IEND", b"")
+
+
+def png_pixels(png):
+    """Return the decompressed IDAT data of a PNG."""
+    pos, idat = 8, b""
+    while pos < len(png):
+        length, chunk_type = struct.unpack_from('>I4s', png, pos)
+        body = png[pos + 8:pos + 8 + length]
+        crc = struct.unpack_from('>I', png, pos + 8 + length)[0]
+        assert crc == zlib.crc32(chunk_type + body) & 0xFFFFFFFF
+        if chunk_type == b"IDAT":
+            idat += body
+        pos += 12 + length
+    return zlib.decompress(idat)
+
+
+class TestAttachmentTypes(unittest.TestCase):
+    """Test cases for attachment MIME types and image optimization."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.test_oft = os.path.join(self.test_dir, "test.oft")
+        self.test_eml = os.path.join(self.test_dir, "test.eml")
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_guess_mime_type(self):
+        """Test magic-byte sniffing and the extension table."""
+        png = make_png(4, 4)
+        self.assertEqual(guess_mime_type("image001", png), "image/png")
+        self.assertEqual(guess_mime_type("photo.png", b"\xff\xd8\xff\xe0rest"), "image/jpeg")
+        self.assertEqual(guess_mime_type("scan.dat", b"%PDF-1.7 ..."), "application/pdf")
+        self.assertEqual(guess_mime_type("a.webp", b"RIFF\x00\x00\x00\x00WEBPVP8 "), "image/webp")
+        self.assertEqual(guess_mime_type("notes.txt", b"BM is not a bitmap here"), "text/plain")
+        self.assertEqual(
+            guess_mime_type("report.docx", b"PK\x03\x04 zipped"),
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        self.assertEqual(guess_mime_type("archive", b"PK\x03\x04 zipped"), "application/zip")
+        self.assertEqual(guess_mime_type("blob.bin", b"\x01\x02\x03"), "application/octet-stream")
+        
+        # ICO needs a plausible directory, not just its four signature bytes
+        ico = (b"\x00\x00\x01\x00\x01\x00" + struct.pack('<BBBBHHII', 16, 16, 0, 0, 1, 32, 40, 22)
+               + bytes(40))
+        self.assertEqual(guess_mime_type("favicon", ico), "image/x-icon")
+        self.assertEqual(guess_mime_type("blob.bin", b"\x00\x00\x01\x00" + bytes(60)),
+                         "application/octet-stream")
+        self.assertEqual(guess_mime_type("data.dat", ico[:30]), "application/octet-stream")
+    
+    def test_repack_png(self):
+        """Test that re-packing shrinks a PNG without changing its pixels."""
+        png = make_png(level=0, text=b"generated by a test")
+        
+        repacked = repack_png(png)
+        
+        self.assertLess(len(repacked), len(png))
+        self.assertEqual(png_pixels(repacked), png_pixels(png))
+        self.assertNotIn(b"tEXt", repacked)
+        # Already optimal or broken input is returned unchanged
+        self.assertEqual(repack_png(repacked), repacked)
+        self.assertEqual(repack_png(png[:40]), png[:40])
+    
+    def test_conversion_types_and_optimization(self):
+        """Test inline detection by content and PNG re-packing during conversion."""
+        png = make_png(level=0)
+        write_test_oft(self.test_oft, attachments=[
+            ("image001", png, "image001@test"),
+            ("photo.png", png),
+            ("scan.dat", b"%PDF-1.4 fake"),
+        ])
+        stats = {}
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            convert_oft_to_eml(self.test_oft, self.test_eml, stats=stats, optimize_images=True)
+        
+        with open(self.test_eml, 'r', encoding='utf-8') as f:
+            msg = message_from_string(f.read())
+        parts = {part.get_filename(): part for part in msg.walk() if part.get_filename()}
+        image = parts["image001"]
+        self.assertEqual(image.get_content_type(), "image/png")
+        self.assertEqual(image['Content-ID'], "<image001@test>")
+        self.assertEqual(png_pixels(image.get_payload(decode=True)), png_pixels(png))
+        self.assertEqual(parts["scan.dat"].get_content_type(), "application/pdf")
+        # Attached (not inline) images are not touched
+        self.assertEqual(parts["photo.png"].get_payload(decode=True), png)
+        self.assertEqual(stats['inline_images'], 1)
+        self.assertEqual(stats['image_bytes_saved'], len(png) - len(image.get_payload(decode=True)))
+        self.assertGreater(stats['image_bytes_saved'], 0)
+
+
+class TestEmbeddedMessages(unittest.TestCase):
+    """Test cases for embedded message conversion."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.test_oft = os.path.join(self.test_dir, "test.oft")
+        self.test_eml = os.path.join(self.test_dir, "test.eml")
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def convert(self, **kwargs):
+        """Convert the test file and return (message, stats)."""
+        stats = {}
+        with patch('sys.stdout', new_callable=io.StringIO):
+            convert_oft_to_eml(self.test_oft, self.test_eml, stats=stats, **kwargs)
+        with open(self.test_eml, 'r', encoding='utf-8') as f:
+            return message_from_string(f.read()), stats
+    
+    def embedded_subjects(self, msg):
+        """Follow the chain of message/rfc822 parts and return their subjects."""
+        subjects = []
+        while True:
+            inner = next((part for part in msg.get_payload()
+                          if part.get_content_type() == 'message/rfc822'), None)
+            if inner is None:
+                return subjects
+            msg = inner.get_payload(0)
+            subjects.append(msg['Subject'])
+    
+    def test_nested_messages(self):
+        """Test that embedded messages become nested message/rfc822 parts."""
+        embedded = nested_messages(3)
+        embedded[0]['attachments'] = [("inner.txt", b"inside")]
+        write_test_oft(self.test_oft, embedded=embedded)
+        
+        msg, stats = self.convert()
+        
+        self.assertEqual(self.embedded_subjects(msg), ["Level 1", "Level 2", "Level 3"])
+        self.assertEqual(stats['embedded_messages'], 3)
+        self.assertEqual(stats['attachments'], 1)
+        level1 = next(part for part in msg.get_payload()
+                      if part.get_content_type() == 'message/rfc822')
+        self.assertEqual(level1.get_filename(), "Level 1.eml")
+        inner_attachment = next(part for part in level1.walk() if part.get_filename() == "inner.txt")
+        self.assertEqual(inner_attachment.get_payload(decode=True), b"inside")
+    
+    def test_limits(self):
+        """Test the depth and size limits."""
+        write_test_oft(self.test_oft, embedded=nested_messages(4))
+        
+        msg, stats = self.convert(max_embed_depth=2)
+        self.assertEqual(self.embedded_subjects(msg), ["Level 1", "Level 2"])
+        self.assertEqual(stats['skipped_embedded'], 1)
+        
+        msg, stats = self.convert(max_embed_bytes=1)
+        self.assertEqual(self.embedded_subjects(msg), ["Level 1"])
+        self.assertEqual(stats['skipped_embedded'], 1)
+    
+    def test_size_limit_skips_large_attachments(self):
+        """Test that attachments past the size limit are left out unread."""
+        write_test_oft(self.test_oft, embedded=[
+            {'subject': "Inner", 'attachments': [("small.txt", b"tiny"),
+                                                 ("big.bin", b"\x00" * 3000000)]},
+        ])
+        
+        msg, stats = self.convert(max_embed_bytes=1000)
+        
+        self.assertEqual(self.embedded_subjects(msg), ["Inner"])
+        filenames = [part.get_filename() for part in msg.walk()]
+        self.assertIn("small.txt", filenames)
+        self.assertNotIn("big.bin", filenames)
+        self.assertEqual(stats['skipped_attachments'], 1)
+        self.assertLessEqual(stats['embedded_bytes'], 1000)
+        self.assertLess(os.path.getsize(self.test_eml), 10000)
+    
+    def test_shared_ole_file(self):
+        """Test that nested messages are read from one open OLE file."""
+        import olefile
+        write_test_oft(self.test_oft, embedded=nested_messages(4))
+        
+        with patch.object(olefile.OleFileIO, 'open', autospec=True,
+                          side_effect=olefile.OleFileIO.open) as ole_open:
+            _, stats = self.convert()
+        
+        self.assertEqual(stats['embedded_messages'], 4)
+        self.assertEqual(ole_open.call_count, 1)
+
+
 class TestGUIFunctions(unittest.TestCase):
     """Test cases for GUI functionality."""
     
@@ -268,6 +637,10 @@ def run_tests():
     
     # Add tests
     suite.addTests(loader.loadTestsFromTestCase(TestOFTtoEMLConverter))
+    suite.addTests(loader.loadTestsFromTestCase(TestPrescan))
+    suite.addTests(loader.loadTestsFromTestCase(TestFastBodies))
+    suite.addTests(loader.loadTestsFromTestCase(TestAttachmentTypes))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmbeddedMessages))
     suite.addTests(loader.loadTestsFromTestCase(TestGUIFunctions))
     
     # Run tests
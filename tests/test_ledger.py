@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Test suite for the shared work ledger.
+
+This module tests:
+- Claiming, completing and lease expiry
+- Output names and output ownership
+- Several worker processes sharing one ledger
+"""
+
+import unittest
+import os
+import io
+import sys
+import json
+import sqlite3
+import subprocess
+import tempfile
+import shutil
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest.mock import patch
+
+from oft_to_eml_ledger import (
+    WorkLedger, run_worker, staged_path_for, STATUS_CLAIMED, ERROR_LEASE_EXPIRED,
+)
+from oft_to_eml_batch import FileResult, convert_file, STATUS_CONVERTED, STATUS_FAILED
+from tests.oft_fixtures import write_test_oft
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+class TestWorkLedger(unittest.TestCase):
+    """Test cases for the work ledger."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.test_dir, "in")
+        self.output_dir = os.path.join(self.test_dir, "out")
+        self.db_path = os.path.join(self.test_dir, "ledger.db")
+        os.makedirs(self.input_dir)
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def make_inputs(self, count):
+        """Write ``count`` small OFT files and return their absolute paths."""
+        return [
+            os.path.abspath(write_test_oft(os.path.join(self.input_dir, f"t{i:02d}.oft"),
+                                           subject=f"Template {i}"))
+            for i in range(count)
+        ]
+
+    def test_claim_and_complete(self):
+        """Test that each file is claimed once and adding is idempotent."""
+        inputs = self.make_inputs(2)
+        ledger = WorkLedger(self.db_path, worker_id="a")
+        self.assertEqual(ledger.add_inputs(inputs), 2)
+        self.assertEqual(ledger.add_inputs(inputs), 0)
+
+        first, second = ledger.claim(), ledger.claim()
+        self.assertEqual({first, second}, set(inputs))
+        self.assertIsNone(ledger.claim())
+
+        self.assertTrue(ledger.complete(first, FileResult(first, STATUS_CONVERTED)))
+        self.assertEqual(ledger.counts()[STATUS_CONVERTED], 1)
+        self.assertEqual(ledger.counts()[STATUS_CLAIMED], 1)
+
+    def test_stale_lease_is_reclaimed(self):
+        """Test that a crashed worker's file is picked up by another worker."""
+        inputs = self.make_inputs(1)
+        crashed = WorkLedger(self.db_path, worker_id="crashed", lease_seconds=-1)
+        crashed.add_inputs(inputs)
+        self.assertEqual(crashed.claim(), inputs[0])
+
+        survivor = WorkLedger(self.db_path, worker_id="survivor")
+        with redirect_stdout(io.StringIO()):
+            results = run_worker(survivor, self.output_dir)
+
+        self.assertEqual([r.status for r in results], [STATUS_CONVERTED])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "t00.eml")))
+        # The late result from the crashed worker is not recorded
+        self.assertFalse(crashed.complete(inputs[0], FileResult(inputs[0], STATUS_FAILED)))
+        self.assertEqual(survivor.counts()[STATUS_CONVERTED], 1)
+
+        # Nor does its late output replace the survivor's file
+        output_path = results[0].output_path
+        with open(output_path, 'rb') as f:
+            converted = f.read()
+        staged_path = staged_path_for(output_path, crashed.worker_id)
+        with open(staged_path, 'w', encoding='utf-8') as f:
+            f.write("late and stale")
+        late = FileResult(inputs[0], STATUS_CONVERTED, output_path=output_path)
+        self.assertFalse(crashed.complete(inputs[0], late, staged_path))
+        with open(output_path, 'rb') as f:
+            self.assertEqual(f.read(), converted)
+        self.assertFalse(os.path.exists(staged_path))
+
+    def test_same_name_in_different_directories(self):
+        """Test that inputs sharing a name are given separate EML files."""
+        first = self.make_inputs(1)[0]
+        other_dir = os.path.join(self.test_dir, "other")
+        os.makedirs(other_dir)
+        second = os.path.abspath(write_test_oft(os.path.join(other_dir, "t00.oft"),
+                                                subject="Other"))
+        WorkLedger(self.db_path, worker_id="a").add_inputs([first])
+        ledger = WorkLedger(self.db_path, worker_id="b")
+        ledger.add_inputs([first, second])
+
+        self.assertEqual(ledger.output_name(first), "t00.eml")
+        self.assertEqual(ledger.output_name(second), "t00_1.eml")
+        with redirect_stdout(io.StringIO()):
+            results = run_worker(ledger, self.output_dir)
+        self.assertEqual(sorted(r.output_path for r in results),
+                         [os.path.join(self.output_dir, "t00.eml"),
+                          os.path.join(self.output_dir, "t00_1.eml")])
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["t00.eml", "t00_1.eml"])
+
+    def test_lease_renewed_during_slow_conversion(self):
+        """Test that a healthy worker keeps a file it converts for longer than the lease."""
+        inputs = self.make_inputs(1)
+        ledger = WorkLedger(self.db_path, worker_id="slow", lease_seconds=0.3)
+        ledger.add_inputs(inputs)
+        other = WorkLedger(self.db_path, worker_id="other", lease_seconds=0.3)
+        takeovers = []
+
+        def slow_convert(*args):
+            time.sleep(1.0)
+            takeovers.append(other.claim())
+            return convert_file(*args)
+
+        with patch('oft_to_eml_ledger.convert_file', side_effect=slow_convert):
+            with redirect_stdout(io.StringIO()):
+                results = run_worker(ledger, self.output_dir)
+
+        self.assertEqual(takeovers, [None])
+        self.assertEqual([r.status for r in results], [STATUS_CONVERTED])
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT attempts FROM work").fetchone()[0], 1)
+
+    def test_max_attempts(self):
+        """Test that a file that keeps losing its lease is marked failed."""
+        inputs = self.make_inputs(1)
+        ledger = WorkLedger(self.db_path, worker_id="a", lease_seconds=-1, max_attempts=2)
+        ledger.add_inputs(inputs)
+
+        self.assertEqual(ledger.claim(), inputs[0])
+        self.assertEqual(ledger.claim(), inputs[0])
+        self.assertIsNone(ledger.claim())
+
+        counts = ledger.counts()
+        self.assertEqual(counts[STATUS_FAILED], 1)
+        with sqlite3.connect(self.db_path) as conn:
+            result = json.loads(conn.execute("SELECT result FROM work").fetchone()[0])
+        self.assertEqual(result['error_category'], ERROR_LEASE_EXPIRED)
+
+    def test_multiple_worker_processes(self):
+        """Test that several processes share the work without duplicates."""
+        inputs = self.make_inputs(12)
+        report_path = os.path.join(self.test_dir, "report.jsonl")
+        command = [sys.executable, str(REPO_ROOT / "oft_to_eml_ledger.py"), self.db_path,
+                   self.input_dir, "-o", self.output_dir, "--report", report_path]
+        workers = [
+            subprocess.Popen(command + ["--worker-id", f"w{i}"], cwd=self.test_dir,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            for i in range(3)
+        ]
+        for worker in workers:
+            _, stderr = worker.communicate(timeout=120)
+            self.assertEqual(worker.returncode, 0, stderr.decode())
+
+        with open(report_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        converted = [r['input_path'] for r in records if r['status'] == STATUS_CONVERTED]
+        self.assertEqual(sorted(converted), sorted(inputs))
+        self.assertEqual(len(os.listdir(self.output_dir)), 12)
+        self.assertEqual(WorkLedger(self.db_path).counts()[STATUS_CONVERTED], 12)
+
+
+if __name__ == "__main__":
+    unittest.main()